@@ -1,86 +1,200 @@
 # agents/config.py
-from crewai import Agent, LLM
+#
+# Agents and LLMs are built lazily: importing this module does not import CrewAI.
+# `from agents.config import code_generator` (or attribute access) constructs the
+# object on first use and caches it for the rest of the process (PEP 562).
+import os
+import threading
 from dotenv import load_dotenv
-from tools.executor import execute as python_executor  # rename for compatibility
 
 
 # Load environment variables
-load_dotenv() 
+load_dotenv()
 
 # --- Initialize Local LLM Connection (The CrewAI Way) ---
 # We use the generic LLM class to explicitly define the provider and base_url
 # This prevents CrewAI from defaulting to the standard OpenAI endpoint.
-ollama_llm = LLM(
-    model="ollama/mistral:7b-instruct", # Prefix with 'ollama/' is critical for some versions
-    base_url="http://localhost:11434"
-)
+OLLAMA_MODEL = "ollama/mistral:7b-instruct" # Prefix with 'ollama/' is critical for some versions
+OLLAMA_BASE_URL = "http://localhost:11434"
+# Keep the model resident between runs so its KV/prefix cache survives (Ollama unloads after 5m by default)
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+
+
+def _llm_kwargs(**overrides):
+    kwargs = {"model": OLLAMA_MODEL, "base_url": OLLAMA_BASE_URL, "keep_alive": OLLAMA_KEEP_ALIVE}
+    kwargs.update(overrides)
+    return kwargs
+
+
+_builders = {}
+_build_lock = threading.RLock()
+
+
+def _lazy(name):
+    """Register a zero-argument builder for the module attribute `name`."""
+    def register(fn):
+        _builders[name] = fn
+        return fn
+    return register
+
+
+def __getattr__(name):
+    builder = _builders.get(name)
+    if builder is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _build_lock:
+        if name not in globals():
+            globals()[name] = builder()
+    return globals()[name]
+
+
+@_lazy("ollama_llm")
+def _build_ollama_llm():
+    from agents.llms import GatewayLLM
+    return GatewayLLM(**_llm_kwargs())
+
+
+@_lazy("review_llm")
+def _build_review_llm():
+    from agents.llms import NormalPriorityLLM
+    return NormalPriorityLLM(**_llm_kwargs())
+
+
+@_lazy("decision_llm")
+def _build_decision_llm():
+    from agents.llms import ShortPriorityLLM
+    return ShortPriorityLLM(**_llm_kwargs())
 # ---------------------------------------
 
 # --- Agent Definitions ---
 
 # Agent 1: Code Generator (The Senior Developer)
-code_generator = Agent(
-    role='Senior Software Developer',
-    goal='Write high-quality, clean, modular, and efficient code based on user requirements.',
-    backstory=(
-        "You are an expert developer with a focus on code integrity and maintainability. "
-        "You always enclose your final output in a single markdown code block."
-    ),
-    verbose=True,
-    llm=ollama_llm,
-    max_iter=3
-)
+def make_code_generator(llm, verbose=True):
+    from crewai import Agent
+    return Agent(
+        role='Senior Software Developer',
+        goal='Write high-quality, clean, modular, and efficient code based on user requirements.',
+        backstory=(
+            "You are an expert developer with a focus on code integrity and maintainability. "
+            "You always enclose your final output in a single markdown code block."
+        ),
+        verbose=verbose,
+        llm=llm,
+        max_iter=3
+    )
+
+
+@_lazy("code_generator")
+def _build_code_generator():
+    return make_code_generator(__getattr__("ollama_llm"))
+
+
+def make_candidate_generator(temperature: float, seed: int):
+    """
+    Code generator with its own sampling params, used for parallel candidate generation.
+    Temperature/seed are part of the gateway key, so candidates are never coalesced.
+    """
+    from agents.llms import GatewayLLM
+    llm = GatewayLLM(**_llm_kwargs(temperature=temperature, seed=seed))
+    return make_code_generator(llm, verbose=False)
+
+# Agent 6: Module Planner (The Architect)
+@_lazy("module_planner")
+def _build_module_planner():
+    from crewai import Agent
+    return Agent(
+        role='Software Architect',
+        goal='Split a requirement into small, independent modules or functions with clearly declared interfaces.',
+        backstory=(
+            "You design systems as sets of small units that can be built and tested independently. "
+            "You answer ONLY with the requested JSON plan."
+        ),
+        verbose=True,
+        llm=__getattr__("review_llm"),
+        max_iter=2,
+        allow_delegation=False
+    )
+
+# Agent 7: Test Writer (The Test Engineer)
+@_lazy("test_writer")
+def _build_test_writer():
+    from crewai import Agent
+    return Agent(
+        role='Software Test Engineer',
+        goal='Write small, fast, independent test cases that expose incorrect behaviour in the provided code.',
+        backstory=(
+            "You think in edge cases and invalid inputs. "
+            "You answer ONLY with the requested JSON list of test cases."
+        ),
+        verbose=True,
+        llm=__getattr__("review_llm"),
+        max_iter=2,
+        allow_delegation=False
+    )
 
 # Agent 2: Code Reviewer (The QA Engineer)
-code_reviewer = Agent(
-    role='Expert QA and Security Auditor',
-    goal='Provide a structured, critical review of the provided code, focusing on security, bugs, style, and performance.',
-    backstory=(
-        "You are meticulous and highly critical. Your only focus is to expose flaws and suggest concrete improvements. "
-        "You MUST output the final report following the exact structured format."
-    ),
-    verbose=True,
-    llm=ollama_llm,
-    max_iter=3
-)
+@_lazy("code_reviewer")
+def _build_code_reviewer():
+    from crewai import Agent
+    return Agent(
+        role='Expert QA and Security Auditor',
+        goal='Provide a structured, critical review of the provided code, focusing on security, bugs, style, and performance.',
+        backstory=(
+            "You are meticulous and highly critical. Your only focus is to expose flaws and suggest concrete improvements. "
+            "You MUST output the final report following the exact structured format."
+        ),
+        verbose=True,
+        llm=__getattr__("review_llm"),
+        max_iter=3
+    )
 
 # Agent 5: Decision Maker (The Auditor - Runs in Parallel)
-decision_maker = Agent(
-    role='System Decision Auditor',
-    goal='Determine if the code requires mandatory refinement by analyzing it and outputting ONLY the word "YES" or "NO".',
-    backstory=(
-        "You are a deterministic system auditor. Your single job is to analyze the generated code "
-        "and produce a one-word decision: YES or NO."
-    ),
-    verbose=True, 
-    llm=ollama_llm,
-    max_iter=3,
-    allow_delegation=False
-)
+@_lazy("decision_maker")
+def _build_decision_maker():
+    from crewai import Agent
+    return Agent(
+        role='System Decision Auditor',
+        goal='Determine if the code requires mandatory refinement by analyzing it and outputting ONLY the word "YES" or "NO".',
+        backstory=(
+            "You are a deterministic system auditor. Your single job is to analyze the generated code "
+            "and produce a one-word decision: YES or NO."
+        ),
+        verbose=True,
+        llm=__getattr__("decision_llm"),
+        max_iter=3,
+        allow_delegation=False
+    )
 
 # --- UPDATED Agent 4: Code Refiner ---
-code_refiner = Agent(
-    role='Junior Developer specializing in Refactoring',
-    goal='Fix code by applying review suggestions AND running the code to ensure it works.',
-    backstory=(
-        "You are responsible for the final, bug-free version of the code. "
-        "You have access to a Python execution tool. "
-        "You should run the code, check the output, and if there is an error, fix it and run it again until it works."
-    ),
-    verbose=True,
-    allow_code_execution=True,
-    llm=ollama_llm,
-    max_iter=5, # Give them more iterations to try/fix/try/fix
-    tools=[python_executor] # <-- GIVE THE AGENT THE TOOL
-)
+@_lazy("code_refiner")
+def _build_code_refiner():
+    from crewai import Agent
+    from tools.executor import execute as python_executor  # rename for compatibility
+    return Agent(
+        role='Junior Developer specializing in Refactoring',
+        goal='Fix code by applying review suggestions AND running the code to ensure it works.',
+        backstory=(
+            "You are responsible for the final, bug-free version of the code. "
+            "You have access to a Python execution tool. "
+            "You should run the code, check the output, and if there is an error, fix it and run it again until it works."
+        ),
+        verbose=True,
+        allow_code_execution=True,
+        llm=__getattr__("ollama_llm"),
+        max_iter=5, # Give them more iterations to try/fix/try/fix
+        tools=[python_executor] # <-- GIVE THE AGENT THE TOOL
+    )
 
 # Agent 3: Documentation Writer (The Technical Writer)
-doc_writer = Agent(
-    role='Senior Technical Writer',
-    goal='Generate professional, complete documentation and README files for the final, correct code.',
-    backstory=(
-        "You convert complex code into simple, well-formatted markdown documents, making the project easy to understand."
-    ),
-    verbose=True,
-    llm=ollama_llm
-)
\ No newline at end of file
+@_lazy("doc_writer")
+def _build_doc_writer():
+    from crewai import Agent
+    return Agent(
+        role='Senior Technical Writer',
+        goal='Generate professional, complete documentation and README files for the final, correct code.',
+        backstory=(
+            "You convert complex code into simple, well-formatted markdown documents, making the project easy to understand."
+        ),
+        verbose=True,
+        llm=__getattr__("review_llm")
+    )
@@ -0,0 +1,254 @@
+# agents/llm_gateway.py
+import contextvars
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from tools import tracing
+
+# Priority classes: lower value = served first when the gateway is saturated.
+PRIORITY_SHORT = 0   # one-word decisions, classifications
+PRIORITY_NORMAL = 1  # reviews, documentation
+PRIORITY_LONG = 2    # full code generation / refinement
+
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("LLM_GATEWAY_MAX_CONCURRENCY", "2"))
+
+# How often a cancellable waiter re-checks its cancel event while queued
+CANCEL_POLL_SECONDS = 0.1
+
+_cancel_event = contextvars.ContextVar("llm_gateway_cancel_event", default=None)
+_prefill_run = contextvars.ContextVar("llm_gateway_prefill_run", default=None)
+
+
+class CancelledCall(Exception):
+    """Raised instead of running a completion whose cancel scope has been set."""
+
+
+@contextmanager
+def cancel_scope(event: threading.Event):
+    """
+    LLM calls made inside this block (in this context) are abandoned once `event`
+    is set: new calls raise CancelledCall immediately and queued calls leave the queue.
+    """
+    token = _cancel_event.set(event)
+    try:
+        yield event
+    finally:
+        _cancel_event.reset(token)
+
+
+class PrioritySemaphore:
+    """
+    Counting semaphore whose waiters are woken in (priority, arrival) order
+    instead of whatever order the OS scheduler picks.
+    """
+
+    def __init__(self, slots: int):
+        if slots < 1:
+            raise ValueError("slots must be >= 1")
+        self._slots = slots
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._counter = itertools.count()
+
+    def acquire(self, priority: int = PRIORITY_NORMAL, cancel: threading.Event | None = None):
+        """Wait for a slot; a waiter whose `cancel` event gets set is dropped with CancelledCall."""
+        with self._cond:
+            ticket = (priority, next(self._counter))
+            heapq.heappush(self._waiters, ticket)
+            while self._slots == 0 or self._waiters[0] != ticket:
+                if cancel is not None and cancel.is_set():
+                    self._waiters.remove(ticket)
+                    heapq.heapify(self._waiters)
+                    # The next waiter in line may now be at the head
+                    self._cond.notify_all()
+                    raise CancelledCall("LLM call cancelled while queued")
+                self._cond.wait(CANCEL_POLL_SECONDS if cancel is not None else None)
+            heapq.heappop(self._waiters)
+            self._slots -= 1
+            # Another slot may still be free for the next waiter in line
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self._slots += 1
+            self._cond.notify_all()
+
+    @property
+    def waiting(self) -> int:
+        with self._cond:
+            return len(self._waiters)
+
+
+class LLMGateway:
+    """
+    Single choke point for LLM completions shared by every session in the process.
+
+      - identical in-flight requests are coalesced: the first caller runs the
+        completion, later callers with the same key wait on its result
+      - a global PrioritySemaphore caps how many completions hit the server at once
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._semaphore = PrioritySemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.stats = {"calls": 0, "coalesced": 0, "completions": 0}
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Stable hash of the request payload (messages, model, sampling params...)."""
+        payload = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def submit(self, key: str, fn, priority: int = PRIORITY_NORMAL):
+        """
+        Run `fn()` under the concurrency limit, or join an identical call already in flight.
+        Exceptions raised by the leader are re-raised in every waiter.
+
+        Inside a cancel_scope the call is never shared (its cancellation must not fail
+        other callers) and raises CancelledCall once the scope's event is set.
+        """
+        cancel = _cancel_event.get()
+        if cancel is not None:
+            if cancel.is_set():
+                raise CancelledCall("LLM call cancelled before submission")
+            with self._lock:
+                self.stats["calls"] += 1
+            with tracing.span("llm.queue_wait", priority=priority, waiting=self._semaphore.waiting):
+                self._semaphore.acquire(priority, cancel=cancel)
+            try:
+                with tracing.span("llm.completion", key=key[:12]):
+                    result = fn()
+            finally:
+                self._semaphore.release()
+            with self._lock:
+                self.stats["completions"] += 1
+            return result
+
+        with self._lock:
+            self.stats["calls"] += 1
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            with tracing.span("llm.coalesced_wait", key=key[:12]):
+                return future.result()
+
+        try:
+            with tracing.span("llm.queue_wait", priority=priority, waiting=self._semaphore.waiting):
+                self._semaphore.acquire(priority)
+            try:
+                with tracing.span("llm.completion", key=key[:12]):
+                    result = fn()
+            finally:
+                self._semaphore.release()
+            future.set_result(result)
+            with self._lock:
+                self.stats["completions"] += 1
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+        return result
+
+
+class PrefillTracker:
+    """
+    Estimates how much of each prompt the model actually has to prefill.
+
+    Ollama reuses the KV cache for the longest prefix shared with the previous
+    prompt it processed for the same model, so per model we keep the last prompt
+    and count the common prefix as cached. Token counts are approximated as
+    characters / CHARS_PER_TOKEN; with several parallel server slots the
+    estimate is an upper bound on cache hits.
+
+    The tracker is shared by every session in the process: only the last
+    `max_calls` rows are kept, each tagged with the run_scope() it was made in,
+    so a report only covers its own run.
+    """
+
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, max_calls: int = 1000):
+        self._lock = threading.Lock()
+        self._last_prompt = {}
+        self._run_ids = itertools.count(1)
+        self.calls = deque(maxlen=max_calls)
+
+    @contextmanager
+    def run_scope(self):
+        """Tag calls recorded in this block (and contexts copied from it) with a new run id."""
+        token = _prefill_run.set(next(self._run_ids))
+        try:
+            yield _prefill_run.get()
+        finally:
+            _prefill_run.reset(token)
+
+    @staticmethod
+    def prompt_text(messages) -> str:
+        if isinstance(messages, str):
+            return messages
+        parts = []
+        for m in messages or []:
+            content = m.get("content") if isinstance(m, dict) else m
+            parts.append(f"{m.get('role', '') if isinstance(m, dict) else ''}:{content}")
+        return "\n".join(parts)
+
+    def record(self, model: str, messages, label: str = "") -> dict:
+        text = self.prompt_text(messages)
+        with self._lock:
+            previous = self._last_prompt.get(model, "")
+            self._last_prompt[model] = text
+            shared = os.path.commonprefix([previous, text])
+            # Any differing character costs at least one prefilled token, so round the
+            # differing suffix up and derive the cached part from it (not the other way round)
+            prompt_tokens = -(-len(text) // self.CHARS_PER_TOKEN)
+            prefill_tokens = -(-(len(text) - len(shared)) // self.CHARS_PER_TOKEN)
+            row = {
+                "run_id": _prefill_run.get(),
+                "label": label,
+                "model": model,
+                "prompt_tokens": prompt_tokens,
+                "cached_tokens": prompt_tokens - prefill_tokens,
+                "prefill_tokens": prefill_tokens,
+            }
+            self.calls.append(row)
+        return row
+
+    def format_report(self, run_id: int | None = None) -> str:
+        """Report the calls of one run (default: the current run_scope)."""
+        run_id = run_id if run_id is not None else _prefill_run.get()
+        with self._lock:
+            rows = [r for r in self.calls if r["run_id"] == run_id]
+        if not rows:
+            return "[Prefill] No LLM calls recorded."
+        lines = [f"[Prefill] {'#':>3} {'label':<12} {'prompt':>8} {'cached':>8} {'prefill':>8}  (approx. tokens)"]
+        for i, r in enumerate(rows, 1):
+            lines.append(
+                f"[Prefill] {i:>3} {r['label'][:12]:<12} {r['prompt_tokens']:>8} "
+                f"{r['cached_tokens']:>8} {r['prefill_tokens']:>8}"
+            )
+        total = sum(r["prompt_tokens"] for r in rows)
+        cached = sum(r["cached_tokens"] for r in rows)
+        share = 100.0 * cached / total if total else 0.0
+        lines.append(f"[Prefill] total prompt={total} cached={cached} prefill={total - cached} ({share:.0f}% reused)")
+        return "\n".join(lines)
+
+
+# Process-wide gateway shared by all sessions / worker threads
+gateway = LLMGateway()
+prefill_tracker = PrefillTracker()
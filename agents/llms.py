@@ -0,0 +1,43 @@
+# agents/llms.py
+from typing import ClassVar
+from crewai import LLM
+from agents.llm_gateway import gateway, prefill_tracker, PRIORITY_SHORT, PRIORITY_NORMAL, PRIORITY_LONG
+from tools import tracing
+
+
+# --- LLM Call Gateway ---
+# Every completion goes through the shared gateway so identical in-flight prompts
+# (e.g. several sessions submitting the same requirement) share one completion,
+# and the number of parallel generations hitting Ollama is capped.
+class GatewayLLM(LLM):
+    gateway_priority: ClassVar[int] = PRIORITY_LONG
+
+    def call(self, messages, *args, **kwargs):
+        key = gateway.make_key(
+            self.model,
+            getattr(self, "temperature", None),
+            getattr(self, "seed", None),
+            messages,
+            kwargs.get("tools"),
+        )
+        # Newer CrewAI versions pass the calling agent, use its role as the report label
+        label = getattr(kwargs.get("from_agent"), "role", None) or type(self).__name__
+
+        with tracing.span("llm.call", model=self.model, priority=self.gateway_priority) as s:
+            def complete():
+                # Only runs on the gateway's leader path, right before the prompt reaches
+                # Ollama: coalesced, cancelled and skipped calls are not counted as prefills
+                prefill = prefill_tracker.record(self.model, messages, label=label)
+                s.attrs.update(prompt_tokens=prefill["prompt_tokens"], prefill_tokens=prefill["prefill_tokens"])
+                return super(GatewayLLM, self).call(messages, *args, **kwargs)
+
+            return gateway.submit(key, complete, priority=self.gateway_priority)
+
+
+class NormalPriorityLLM(GatewayLLM):
+    gateway_priority: ClassVar[int] = PRIORITY_NORMAL
+
+
+class ShortPriorityLLM(GatewayLLM):
+    # Short prompts (YES/NO decisions) jump ahead of long generation prompts
+    gateway_priority: ClassVar[int] = PRIORITY_SHORT
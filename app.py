@@ -7,10 +7,14 @@ import importlib
 import os
 import re
 import time
+import contextvars
 from typing import Dict
 
 # Import Crew runner and sandbox tools
 from tools.sandbox_subprocess import run_code_in_subprocess
+from tools.execution_supervisor import supervise, failure_summary, OK, DETERMINISTIC
+from tools.execution_policy import classify_requirement
+from tools import tracing
 
 # -------------------------
 # Page config and CSS
@@ -39,11 +43,6 @@ body { background: #0b1220; color: #cfe8ff; }
 
 st.title("🤖 AI Software Crew — Live Execution")
 
-# -------------------------
-# Layout: left = logs, right = Docker execution
-# -------------------------
-left_col, right_col = st.columns([2, 2])
-
 # -------------------------
 # Sidebar controls
 # -------------------------
@@ -59,6 +58,19 @@ with st.sidebar:
     )
     run_crew_btn = st.button("🚀 Run Crew")
 
+# -------------------------
+# Queue that traces how long each line waited before the UI drained it
+# -------------------------
+class TimedQueue(queue.Queue):
+    def _put(self, item):
+        super()._put((time.time(), tracing.current(), item))
+
+    def _get(self):
+        put_at, parent, item = super()._get()
+        if parent is not None and parent.sampled:
+            tracing.record_span("app.queue_wait", put_at, time.time(), parent=parent)
+        return item
+
 # -------------------------
 # Thread-safe queue logger
 # -------------------------
@@ -81,6 +93,13 @@ class QueueLogger:
 # Crew runner thread
 # -------------------------
 def crew_runner(req_text: str, mdl: str, q: queue.Queue, result_holder: Dict):
+    with tracing.span("app.crew_runner", model=mdl):
+        # Saved so the execution thread started later by the UI joins this run's trace
+        result_holder["trace_context"] = contextvars.copy_context()
+        _crew_runner(req_text, mdl, q, result_holder)
+
+
+def _crew_runner(req_text: str, mdl: str, q: queue.Queue, result_holder: Dict):
     os.environ["OPENAI_MODEL_NAME"] = mdl
     os.environ["OPENAI_TEMPERATURE"] = str(temp)
     os.environ["OPENAI_MAX_TOKENS"] = str(max_tokens)
@@ -112,36 +131,69 @@ def crew_runner(req_text: str, mdl: str, q: queue.Queue, result_holder: Dict):
 # -------------------------
 # Junior Dev Docker runner
 # -------------------------
-def run_junior_dev_docker(code: str, q: queue.Queue):
+MAX_FIX_ROUNDS = 2  # refiner rounds for deterministic failures
+
+
+def run_junior_dev_docker(code: str, q: queue.Queue, req_text: str = "", result: dict | None = None):
+    """
+    Run the crew's code in the sandbox, sending deterministic failures back to the refiner.
+    The code that was last run (the refiner's fix, if any) and its outcome are written
+    back into `result` as "executed_code" / "execution_outcome" for the deliverables.
+    """
+    with tracing.span("app.junior_dev"):
+        _run_junior_dev_docker(code, q, req_text, result if result is not None else {})
+
+
+def _run_junior_dev_docker(code: str, q: queue.Queue, req_text: str, result: dict):
     q.put("[Docker] Junior Developer running code in Docker...")
     # For simplicity, using sandbox runner (replace with Docker API if desired)
     def stream(line: str, is_err: bool):
         prefix = "[stderr]" if is_err else "[stdout]"
         q.put(f"{prefix} {line}")
 
-    # Try running up to 3 attempts
-    attempts = 0
-    while attempts < 3:
-        attempts += 1
-        q.put(f"[Docker] Attempt {attempts}...")
-        res = run_code_in_subprocess(code, timeout=60)
-        stdout = res.get("stdout", "")
-        stderr = res.get("stderr", "")
-        if res.get("status") == "success" and res.get("returncode") == 0:
+    def report(message: str):
+        q.put(f"[Docker] {message}")
+
+    # Deadlines/rlimits are adaptive (tools/execution_policy.py), learned per requirement class
+    requirement_class = classify_requirement(req_text)
+    q.put(f"[Docker] Requirement class: {requirement_class}")
+
+    # Only transient failures are retried as-is; deterministic ones go back to the refiner
+    total_attempts = 0
+    for fix_round in range(MAX_FIX_ROUNDS + 1):
+        run = supervise(
+            lambda: run_code_in_subprocess(code, stream_consumer=stream, requirement_class=requirement_class),
+            report=report,
+        )
+        total_attempts += len(run["attempts"])
+        outcome = run["outcome"]
+        if outcome == OK:
             q.put("[Docker] Execution successful!")
             break
-        else:
-            q.put(f"[Docker] Execution failed: {stderr or 'Unknown error'}")
-            q.put("[Docker] Junior Developer fixing code and retrying...")
-            # naive "fix": just try again (replace with actual AI refinement if integrated)
-            time.sleep(1)
-    q.put("[Docker] Docker execution finished.")
+        q.put(f"[Docker] Execution failed ({outcome}): {failure_summary(run['result'], 500)}")
+        if outcome != DETERMINISTIC or fix_round == MAX_FIX_ROUNDS:
+            break
+        q.put(f"[Docker] Junior Developer fixing the code (round {fix_round + 1}/{MAX_FIX_ROUNDS})...")
+        try:
+            import main
+            fixed = main.refine_after_failure(req_text, code, failure_summary(run["result"]))
+        except Exception as e:
+            q.put(f"[Docker] Refiner failed: {e}")
+            break
+        if not fixed or fixed == code:
+            q.put("[Docker] Refiner returned no change, giving up.")
+            break
+        code = fixed
+    result["executed_code"] = code
+    result["execution_outcome"] = outcome
+    q.put(f"[Docker] Docker execution finished: {outcome} after {total_attempts} attempt(s), "
+          f"{fix_round} fix round(s).")
 
 # -------------------------
 # Initialize session_state
 # -------------------------
 if "crew_queue" not in st.session_state:
-    st.session_state["crew_queue"] = queue.Queue()
+    st.session_state["crew_queue"] = TimedQueue()
 if "crew_result" not in st.session_state:
     st.session_state["crew_result"] = {"result": None, "error": None}
 if "log_lines" not in st.session_state:
@@ -159,75 +211,106 @@ if run_crew_btn and not st.session_state["crew_running"]:
         st.warning("Please enter requirements first.")
     else:
         st.session_state["crew_running"] = True
-        st.session_state["crew_queue"] = queue.Queue()
+        st.session_state["crew_queue"] = TimedQueue()
         st.session_state["crew_result"] = {"result": None, "error": None}
+        st.session_state["run_requirements"] = requirements
+        st.session_state["log_lines"] = []
+        st.session_state["docker_done"] = False
+        st.session_state["docker_queue"] = None
+        st.session_state["docker_thread"] = None
+        st.session_state["docker_lines"] = []
         t = threading.Thread(
             target=crew_runner,
             args=(requirements, model, st.session_state["crew_queue"], st.session_state["crew_result"]),
             daemon=True
         )
         t.start()
+        st.session_state["crew_thread"] = t
 
 # -------------------------
-# Left column: Agent logs
+# Live view: polls the queues at a fixed cadence inside a fragment, so only this
+# block reruns (not the CSS, sidebar and deliverables) while a run is active.
 # -------------------------
-with left_col:
-    st.subheader("Agent Logs")
-    log_placeholder = st.empty()
+POLL_INTERVAL = 0.5  # seconds
+_fragment = getattr(st, "fragment", None) or st.experimental_fragment
 
-# -------------------------
-# Right column: Docker execution logs
-# -------------------------
-with right_col:
-    st.subheader("Docker / Junior Dev Execution")
-    docker_placeholder = st.empty()
 
-# -------------------------
-# Poll queues and update UI
-# -------------------------
-log_lines = st.session_state["log_lines"]
-crew_queue = st.session_state.get("crew_queue")
-crew_result = st.session_state.get("crew_result")
+def _drain(q, lines):
+    """Append only the events queued since the last poll."""
+    while q is not None and not q.empty():
+        lines.append(q.get_nowait())
 
-if crew_queue:
-    while not crew_queue.empty():
-        ln = crew_queue.get_nowait()
-        log_lines.append(ln)
 
-st.session_state["log_lines"] = log_lines
-log_placeholder.markdown(
-    "<div class='terminal'>" + "<br>".join(log_lines) + "</div>", unsafe_allow_html=True
-)
+def _thread_busy(name):
+    t = st.session_state.get(name)
+    return t is not None and t.is_alive()
 
-# -------------------------
-# Launch Docker run automatically if Crew finished
-# -------------------------
-if crew_result.get("result") and not st.session_state["docker_done"]:
+
+def _launch_docker_if_ready(crew_result):
+    if not crew_result.get("result") or st.session_state["docker_done"]:
+        return
     code_to_run = crew_result["result"].get("refined_code") or crew_result["result"].get("generated_code")
     if code_to_run:
         st.session_state["docker_done"] = True
-        docker_queue = queue.Queue()
-        t = threading.Thread(target=run_junior_dev_docker, args=(code_to_run, docker_queue), daemon=True)
+        docker_queue = TimedQueue()
+        t = threading.Thread(
+            target=tracing.propagate(run_junior_dev_docker, crew_result.get("trace_context")),
+            args=(code_to_run, docker_queue, st.session_state.get("run_requirements", ""), crew_result["result"]),
+            daemon=True
+        )
         t.start()
         st.session_state["docker_queue"] = docker_queue
+        st.session_state["docker_thread"] = t
 
-# -------------------------
-# Poll Docker queue
-# -------------------------
-docker_queue = st.session_state.get("docker_queue")
-docker_lines = st.session_state.get("docker_lines", [])
-if docker_queue:
-    while not docker_queue.empty():
-        ln = docker_queue.get_nowait()
-        docker_lines.append(ln)
-st.session_state["docker_lines"] = docker_lines
-docker_placeholder.markdown(
-    "<div class='terminal'>" + "<br>".join(docker_lines) + "</div>", unsafe_allow_html=True
-)
+
+@_fragment(run_every=POLL_INTERVAL if st.session_state["crew_running"] else None)
+def live_view():
+    # Layout: left = logs, right = Docker execution
+    left_col, right_col = st.columns([2, 2])
+
+    crew_queue = st.session_state.get("crew_queue")
+    crew_result = st.session_state.get("crew_result")
+    log_lines = st.session_state["log_lines"]
+    _drain(crew_queue, log_lines)
+
+    # Launch Docker run automatically if Crew finished
+    _launch_docker_if_ready(crew_result)
+
+    docker_queue = st.session_state.get("docker_queue")
+    docker_lines = st.session_state.setdefault("docker_lines", [])
+    _drain(docker_queue, docker_lines)
+
+    with left_col:
+        st.subheader("Agent Logs")
+        st.markdown(
+            "<div class='terminal'>" + "<br>".join(log_lines) + "</div>", unsafe_allow_html=True
+        )
+    with right_col:
+        st.subheader("Docker / Junior Dev Execution")
+        st.markdown(
+            "<div class='terminal'>" + "<br>".join(docker_lines) + "</div>", unsafe_allow_html=True
+        )
+
+    # Run finished: stop polling and rerun the full page once to show the deliverables
+    finished = (
+        st.session_state["crew_running"]
+        and not _thread_busy("crew_thread")
+        and not _thread_busy("docker_thread")
+        and (crew_queue is None or crew_queue.empty())
+        and (docker_queue is None or docker_queue.empty())
+        and (crew_result.get("error") or st.session_state["docker_done"] or crew_result.get("result"))
+    )
+    if finished:
+        st.session_state["crew_running"] = False
+        st.rerun()
+
+
+live_view()
 
 # -------------------------
 # Display final deliverables
 # -------------------------
+crew_result = st.session_state["crew_result"]
 if crew_result.get("error"):
     st.error("Crew Error: " + str(crew_result["error"]))
 elif crew_result.get("result"):
@@ -235,7 +318,14 @@ elif crew_result.get("result"):
     st.subheader("Final Deliverables")
     r = crew_result["result"]
     st.markdown("### Generated / Refined Code (first 5000 chars):")
-    st.code((r.get("refined_code") or r.get("generated_code") or "No code"), language="python")
+    if r.get("executed_code") and r["executed_code"] != (r.get("refined_code") or r.get("generated_code")):
+        st.caption("Fixed by the Junior Developer after a failed sandbox run.")
+    if r.get("execution_outcome"):
+        st.caption(f"Sandbox outcome: {r['execution_outcome']}")
+    st.code((r.get("executed_code") or r.get("refined_code") or r.get("generated_code") or "No code"), language="python")
+    if r.get("test_report"):
+        st.markdown("### Generated Tests")
+        st.markdown(r["test_report"])
     st.markdown("### Review Report")
     st.write(r.get("review_report", "—"))
     st.markdown("### Documentation")
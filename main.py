@@ -1,10 +1,24 @@
 # main.py
+#
+# CrewAI, the task definitions and the agents are imported lazily inside the
+# functions that need them, so `python main.py --help`, batch workers and
+# `importlib.reload(main)` in app.py do not pay for them up front.
+# Measure with: python -m tools.startup_profile
 import os
 import re
+import ast
+import json
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from crewai import Crew, Process
-from tasks.tasks import SoftwareTasks
-from agents.config import code_generator, code_reviewer, code_refiner, doc_writer, decision_maker
+from agents.config import make_candidate_generator, make_code_generator
+from tools.sandbox_subprocess import run_code_in_subprocess
+from tools.execution_supervisor import failure_summary
+from tools.execution_policy import classify_requirement, requirement_context
+from tools.test_sharding import parse_test_cases, run_tests_sharded, format_matrix
+from tools import tracing
+from agents.llm_gateway import prefill_tracker, gateway, cancel_scope, CancelledCall
 
 # Disable telemetry
 os.environ["CREWAI_TELEMETRY_OPT_OUT"] = "true"
@@ -23,24 +37,356 @@ def clean_output(text):
     return re.sub(r"```[a-zA-Z]*|```", "", text).strip()
 
 
-def run_software_crew(requirements: str):
+# --- PARALLEL CANDIDATE GENERATION ---
+# Number of concurrent code candidates (1 = classic single-generation pipeline)
+DEFAULT_CANDIDATES = int(os.environ.get("CREW_CANDIDATES", "1"))
+
+
+def run_single_task(agent, task, verbose=False):
+    """Run one task in its own throwaway crew (used by the parallel pre-review stages)."""
+    from crewai import Crew, Process
+    Crew(agents=[agent], tasks=[task], process=Process.sequential, verbose=verbose).kickoff()
+    return task
+
+
+def preflight(code: str):
+    """Cheap syntax check before spending a sandbox run. Returns an error string or None."""
+    if not code.strip():
+        return "empty output"
+    try:
+        compile(code, "<candidate>", "exec")
+    except SyntaxError as e:
+        return f"SyntaxError: {e}"
+    return None
+
+
+def candidate_passes(code: str) -> bool:
+    if preflight(code):
+        return False
+    # Deadline and rlimits come from the execution policy (requirement class set by run_software_crew)
+    res = run_code_in_subprocess(code)
+    return res.get("status") == "finished" and res.get("returncode") == 0
+
+
+def run_candidate_stage(tasks_manager, candidates: int):
+    """
+    Generate `candidates` code solutions concurrently with varied temperature/seed.
+    Each candidate is sandboxed as soon as it finishes; the first one passing
+    pre-flight and execution wins and the others are cancelled: candidates not yet
+    started are skipped, and the LLM calls of running ones raise CancelledCall at
+    their next submission or while queued in the gateway. Only a completion already
+    streaming from the server runs to the end (its result is discarded).
+
+    Returns the winning (already executed) generation Task, or the first finished
+    candidate if none passes, so review/refine can still work on it.
+    """
+    stop = threading.Event()
+
+    def _generate(index: int):
+        if stop.is_set():
+            return None
+        temperature = 0.2 + 0.6 * index / max(1, candidates - 1)
+        with tracing.span("crew.candidate", index=index, temperature=temperature), cancel_scope(stop):
+            agent = make_candidate_generator(temperature=temperature, seed=index + 1)
+            return run_single_task(agent, tasks_manager.generate_code_task(agent))
+
+    fallback = None
+    generate = tracing.propagate(_generate)
+    # No more workers than gateway slots: extra candidates stay queued in the pool,
+    # where they can still be skipped once a winner is found
+    workers = max(1, min(candidates, gateway.max_concurrency))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="candidate")
+    try:
+        futures = {pool.submit(generate, i): i for i in range(candidates)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                task = future.result()
+            except CancelledCall:
+                continue
+            except Exception as e:
+                print(f"[Candidates] Candidate {index} failed: {e}", flush=True)
+                continue
+            if task is None:
+                continue
+            fallback = fallback or task
+            if candidate_passes(clean_output(str(task.output))):
+                print(f"[Candidates] Candidate {index} passed, cancelling the rest", flush=True)
+                stop.set()
+                return task
+            print(f"[Candidates] Candidate {index} did not pass", flush=True)
+    finally:
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    print("[Candidates] No candidate passed, continuing with the first one", flush=True)
+    return fallback
+
+
+# --- REQUIREMENT DECOMPOSITION ---
+DEFAULT_DECOMPOSE = os.environ.get("CREW_DECOMPOSE", "0") == "1"
+MAX_UNITS = 6
+UNIT_WORKERS = int(os.environ.get("CREW_UNIT_WORKERS", "4"))
+
+
+def parse_plan(text: str):
+    """Parse the planner's JSON array. Returns a list of units or None if unusable."""
+    match = re.search(r"\[.*\]", clean_output(text), re.DOTALL)
+    if not match:
+        return None
+    try:
+        plan = json.loads(match.group(0))
+    except ValueError:
+        return None
+    units = [
+        {
+            "name": str(u["name"]),
+            "interface": str(u.get("interface", "")),
+            "description": str(u.get("description", "")),
+        }
+        for u in plan
+        if isinstance(u, dict) and u.get("name")
+    ]
+    return units[:MAX_UNITS] or None
+
+
+def _split_imports(code: str):
+    """
+    Split a unit into (top-level import statements, remaining source), using the
+    ast line spans so parenthesised multi-line imports move as a whole. Imports
+    sharing a line with another statement, and units that do not parse, stay in place.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return [], code
+    lines = code.splitlines()
+    owners = {}
+    for node in tree.body:
+        for lineno in range(node.lineno, node.end_lineno + 1):
+            owners.setdefault(lineno, []).append(node)
+    imports, hoisted = [], set()
+    for node in tree.body:
+        if not isinstance(node, (ast.Import, ast.ImportFrom)):
+            continue
+        span = range(node.lineno, node.end_lineno + 1)
+        if any(owners[lineno] != [node] for lineno in span):
+            continue
+        imports.append((node, "\n".join(lines[lineno - 1] for lineno in span)))
+        hoisted.update(span)
+    body = "\n".join(line for i, line in enumerate(lines, 1) if i not in hoisted)
+    return imports, body
+
+
+def assemble_units(codes):
+    """
+    Concatenate unit sources into one file, hoisting top-level imports
+    (deduplicated, in first-seen order, `__future__` imports first) above the unit bodies.
+    """
+    future, imports, bodies = [], [], []
+    for code in codes:
+        unit_imports, body = _split_imports(code)
+        for node, text in unit_imports:
+            target = future if isinstance(node, ast.ImportFrom) and node.module == "__future__" else imports
+            if text not in target:
+                target.append(text)
+        bodies.append(body.strip())
+    header = "\n".join(future + imports)
+    return header + "\n\n\n" + "\n\n\n".join(b for b in bodies if b) + "\n"
+
+
+def unit_failure(codes):
+    """
+    Sandbox the last of `codes` assembled on top of the units before it (a unit may
+    use anything its predecessors define). Returns an error string or None.
+    """
+    code = assemble_units(codes)
+    error = preflight(code)
+    if error:
+        return error
+    res = run_code_in_subprocess(code)
+    if res.get("status") == "finished" and res.get("returncode") == 0:
+        return None
+    return failure_summary(res, 1000)
+
+
+def run_decomposition_stage(tasks_manager):
+    """
+    Plan the requirement as independent units, generate them in parallel, sandbox-test
+    each one on top of the units before it (one regeneration per unit, given the error),
+    then assemble the final file.
+    Returns the assembled code, or None if the plan was unusable.
+    """
+    from agents.config import module_planner, ollama_llm
+
+    task_plan = tasks_manager.plan_modules_task(module_planner, max_units=MAX_UNITS)
+    run_single_task(module_planner, task_plan, verbose=True)
+    plan = parse_plan(str(task_plan.output))
+    if not plan:
+        print("[Plan] Could not parse a plan, falling back to single-file generation", flush=True)
+        return None
+    print(f"[Plan] {len(plan)} units: {', '.join(u['name'] for u in plan)}", flush=True)
+
+    def _generate(unit, attempt, error=None):
+        with tracing.span("crew.unit", unit=unit["name"], attempt=attempt):
+            agent = make_code_generator(ollama_llm, verbose=False)
+            task = run_single_task(agent, tasks_manager.generate_unit_task(agent, unit, plan, error=error))
+            return clean_output(str(task.output))
+
+    # Generation only needs the declared interfaces, so units are generated in parallel
+    # and only syntax-checked here; a syntax error is fed back into the one retry.
+    @tracing.propagate
+    def _build_unit(unit):
+        code = _generate(unit, 1)
+        error = preflight(code)
+        if error is None:
+            return code, False
+        print(f"[Plan] Unit {unit['name']} does not compile, regenerating: {error}", flush=True)
+        return _generate(unit, 2, error), True
+
+    with ThreadPoolExecutor(max_workers=min(UNIT_WORKERS, len(plan)), thread_name_prefix="unit") as pool:
+        built = list(pool.map(_build_unit, plan))
+    codes = [code for code, _ in built]
+
+    # Sandbox units in plan order on top of their predecessors. Units after one that
+    # still fails cannot be judged on their own, they are left to the assembled check.
+    for i, unit in enumerate(plan):
+        # The entry point needs every other unit, it is only checked after assembly
+        if unit["name"] == "main":
+            continue
+        error = unit_failure(codes[:i + 1])
+        if error and not built[i][1]:
+            print(f"[Plan] Unit {unit['name']} failed, regenerating with the error", flush=True)
+            codes[i] = _generate(unit, 2, error)
+            error = unit_failure(codes[:i + 1])
+        if error:
+            print(f"[Plan] Unit {unit['name']} still failing, keeping last attempt", flush=True)
+            break
+        print(f"[Plan] Unit {unit['name']} passed", flush=True)
+
+    code = assemble_units(codes)
+    status = "passed" if candidate_passes(code) else "failed"
+    print(f"[Plan] Assembled program {status} sandbox execution", flush=True)
+    return code
+
+
+# --- SHARDED GENERATED TESTS ---
+DEFAULT_TESTS = os.environ.get("CREW_TESTS", "0") == "1"
+TEST_WORKERS = int(os.environ.get("CREW_TEST_WORKERS", "0")) or None  # None = CPU count
+
+
+def run_test_stage(tasks_manager, task_gen):
+    """
+    Have the test writer emit test cases for the generated code, run them sharded
+    across concurrent sandbox processes and return the pass/fail matrix (markdown).
+    """
+    from agents.config import test_writer
+
+    task_tests = run_single_task(test_writer, tasks_manager.write_tests_task(test_writer, task_gen), verbose=True)
+    tests = parse_test_cases(str(task_tests.output))
+    if not tests:
+        print("[Tests] Test writer produced no usable test cases", flush=True)
+        return None
+    results = run_tests_sharded(clean_output(str(task_gen.output)), tests, workers=TEST_WORKERS)
+    matrix = format_matrix(results)
+    print(f"[Tests]\n{matrix}", flush=True)
+    return matrix
+
+
+def refine_after_failure(requirements: str, code: str, error: str) -> str:
+    """Ask the refiner for a real fix of a deterministic execution failure."""
+    from tasks.tasks import SoftwareTasks
+    from agents.config import code_refiner
+
+    task = SoftwareTasks(requirements).fix_execution_error_task(code_refiner, code, error)
+    with tracing.span("crew.fix_execution_error"):
+        run_single_task(code_refiner, task)
+    return clean_output(str(task.output))
+
+
+def _trace_step(step):
+    """Crew step callback: one trace event per agent iteration."""
+    tracing.event("agent.step", kind=type(step).__name__, tool=getattr(step, "tool", None))
+
+
+def _trace_task(output):
+    tracing.event("task.done", agent=getattr(output, "agent", None))
+
+
+def run_software_crew(requirements: str,
+                      candidates: int = DEFAULT_CANDIDATES,
+                      decompose: bool = DEFAULT_DECOMPOSE,
+                      tests: bool = DEFAULT_TESTS):
+    requirement_class = classify_requirement(requirements)
+    with prefill_tracker.run_scope() as run_id:
+        with tracing.span("crew.run", candidates=candidates, decompose=decompose, tests=tests,
+                          requirement_class=requirement_class):
+            with requirement_context(requirement_class):
+                result = _run_software_crew(requirements, candidates, decompose, tests)
+    print(prefill_tracker.format_report(run_id), flush=True)
+    return result
+
+
+def _run_software_crew(requirements, candidates, decompose, tests):
+    from crewai import Crew, Process
+    from crewai.tasks.task_output import TaskOutput
+    from tasks.tasks import SoftwareTasks
+    from agents.config import code_generator, code_reviewer, code_refiner, doc_writer, decision_maker
+
     tasks_manager = SoftwareTasks(requirements)
 
-    task_gen = tasks_manager.generate_code_task(code_generator)
+    task_gen = None
+    if decompose:
+        print("\n--- PLANNING MODULES ---\n", flush=True)
+        with tracing.span("crew.decomposition"):
+            assembled = run_decomposition_stage(tasks_manager)
+        if assembled is not None:
+            # Attach the assembled code as the generation output so it is the review context
+            task_gen = tasks_manager.generate_code_task(code_generator)
+            task_gen.output = TaskOutput(
+                description=task_gen.description,
+                raw=f"```python\n{assembled}```",
+                agent=code_generator.role,
+            )
+
+    if task_gen is None and candidates > 1:
+        print(f"\n--- GENERATING {candidates} CANDIDATES ---\n", flush=True)
+        with tracing.span("crew.candidates", candidates=candidates):
+            task_gen = run_candidate_stage(tasks_manager, candidates)
+
+    # The generation task only runs inside the main crew when no candidate was pre-generated
+    pending_tasks = []
+    if task_gen is None:
+        task_gen = tasks_manager.generate_code_task(code_generator)
+        if tests:
+            # The tests need the code before the refine/doc prompts are built
+            run_single_task(code_generator, task_gen, verbose=True)
+        else:
+            pending_tasks.append(task_gen)
+
+    test_report = None
+    if tests:
+        print("\n--- RUNNING GENERATED TESTS ---\n", flush=True)
+        with tracing.span("crew.tests"):
+            test_report = run_test_stage(tasks_manager, task_gen)
+
     task_review = tasks_manager.review_code_task(code_reviewer, task_gen)
     task_decision = tasks_manager.make_refine_decision_task(decision_maker, task_gen)
-    task_refine = tasks_manager.refine_code_task(code_refiner, task_gen, task_review)
-    task_doc = tasks_manager.document_code_task(doc_writer, task_refine, task_review)
+    task_refine = tasks_manager.refine_code_task(code_refiner, task_gen, task_review, test_report)
+    task_doc = tasks_manager.document_code_task(doc_writer, task_refine, task_review, test_report)
 
     crew = Crew(
         agents=[code_generator, code_reviewer, code_refiner, doc_writer, decision_maker],
-        tasks=[task_gen, task_review, task_decision, task_refine, task_doc],
+        tasks=pending_tasks + [task_review, task_decision, task_refine, task_doc],
         process=Process.sequential,
-        verbose=True
+        verbose=True,
+        step_callback=_trace_step,
+        task_callback=_trace_task
     )
 
     print("\n--- RUNNING CREW ---\n", flush=True)
-    crew.kickoff()
+    with tracing.span("crew.kickoff"):
+        crew.kickoff()
     print("\n--- CREW DONE ---\n", flush=True)
 
     return {
@@ -49,10 +395,27 @@ def run_software_crew(requirements: str):
         "decision": str(task_decision.output).strip(),
         "refined_code": clean_output(str(task_refine.output)),
         "documentation": str(task_doc.output),
+        "test_report": test_report,
     }
 
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the AI software crew (generate, review, refine, document) on a requirement.",
+        epilog="Import-time profile / cold-start measurement: python -m tools.startup_profile",
+    )
+    parser.add_argument("requirements", nargs="?", help="requirement text (prompted for if omitted)")
+    parser.add_argument("--candidates", type=int, default=DEFAULT_CANDIDATES,
+                        help="number of parallel code candidates (default: %(default)s)")
+    parser.add_argument("--decompose", action="store_true", default=DEFAULT_DECOMPOSE,
+                        help="plan the requirement as independent units generated in parallel")
+    parser.add_argument("--tests", action="store_true", default=DEFAULT_TESTS,
+                        help="generate test cases and run them sharded across sandbox processes")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    req = input("Enter requirements: ")
-    result = run_software_crew(req)
+    args = parse_args()
+    req = args.requirements or input("Enter requirements: ")
+    result = run_software_crew(req, candidates=args.candidates, decompose=args.decompose, tests=args.tests)
     print(result)
@@ -1,6 +1,10 @@
 # tasks/tasks.py
 from crewai import Task
 
+# Prompt layout: every description starts with the agent's static instructions and
+# rules, and variable content (requirements, code, errors) comes LAST. Consecutive
+# calls of the same agent then share a long identical prefix that Ollama can reuse
+# from its KV cache instead of re-prefilling it.
 class SoftwareTasks:
     def __init__(self, requirements):
         self.requirements = requirements
@@ -12,19 +16,69 @@ class SoftwareTasks:
         return Task(
             description=(
                 "You are the Code Generation Agent.\n"
-                "Generate the full and complete code solution for the following requirements:\n"
-                f"{self.requirements}\n\n"
+                "Generate the full and complete code solution for the REQUIREMENTS below.\n\n"
                 "STRICT RULES:\n"
                 "• Output MUST be ONLY a single fenced code block.\n"
                 "• NO explanations, NO intro text, NO bullet points.\n"
                 "• The code must be syntactically correct and runnable.\n"
-                "• Prefer minimal dependencies unless explicitly required.\n"
+                "• Prefer minimal dependencies unless explicitly required.\n\n"
+                f"REQUIREMENTS:\n{self.requirements}\n"
             ),
             agent=agent,
             expected_output="A single valid markdown code block containing complete runnable code.",
             async_execution=False
         )
 
+    # ===========================
+    # 1a) MODULE PLANNING (optional decomposition stage)
+    # ===========================
+    def plan_modules_task(self, agent, max_units=6):
+        return Task(
+            description=(
+                "You are the Planning Agent.\n"
+                "Split the REQUIREMENTS below into independent units (modules, classes or functions).\n\n"
+                "STRICT RULES:\n"
+                "• Output ONLY a JSON array, NO explanations.\n"
+                "• Each item: {\"name\": str, \"interface\": str, \"description\": str}.\n"
+                "• `interface` is the exact Python signature(s) the unit must expose.\n"
+                "• Units may only depend on interfaces of units listed BEFORE them.\n"
+                "• The LAST unit must be named \"main\" and wire everything together "
+                "under `if __name__ == \"__main__\":`.\n"
+                f"• At most {max_units} units.\n\n"
+                f"REQUIREMENTS:\n{self.requirements}\n"
+            ),
+            agent=agent,
+            expected_output="A JSON array of units with name, interface and description.",
+            async_execution=False
+        )
+
+    # ===========================
+    # 1b) UNIT GENERATION (one per planned unit)
+    # ===========================
+    def generate_unit_task(self, agent, unit, plan, error=None):
+        interfaces = "\n".join(f"- {u['name']}: {u['interface']}" for u in plan)
+        retry = f"\nYOUR PREVIOUS ATTEMPT FAILED WITH:\n{error}\n" if error else ""
+        return Task(
+            description=(
+                "You are the Code Generation Agent.\n"
+                "You are implementing ONE unit of a larger program.\n\n"
+                "STRICT RULES:\n"
+                "• Output MUST be ONLY a single fenced code block.\n"
+                "• Do NOT re-implement other units; assume their interfaces exist in the same file.\n"
+                "• Importing the code must have no side effects outside `if __name__ == \"__main__\":`.\n"
+                "• The code must be syntactically correct.\n\n"
+                f"OVERALL REQUIREMENTS:\n{self.requirements}\n\n"
+                f"DECLARED INTERFACES OF ALL UNITS:\n{interfaces}\n\n"
+                f"UNIT TO IMPLEMENT: `{unit['name']}`\n"
+                f"Interface: {unit['interface']}\n"
+                f"Description: {unit['description']}\n"
+                f"{retry}"
+            ),
+            agent=agent,
+            expected_output="A single valid markdown code block implementing the unit.",
+            async_execution=False
+        )
+
     # ===========================
     # 2) CODE REVIEW
     # ===========================
@@ -70,10 +124,34 @@ class SoftwareTasks:
             async_execution=False
         )
 
+    # ===========================
+    # 3b) TEST CASE GENERATION (optional test stage)
+    # ===========================
+    def write_tests_task(self, agent, code_context, max_tests=12):
+        return Task(
+            description=(
+                "You are the Test Writing Agent.\n"
+                "Write small, independent test cases for the code provided in CONTEXT.\n\n"
+                "STRICT RULES:\n"
+                "• Output ONLY a JSON array, NO explanations.\n"
+                "• Each item: {\"name\": str, \"code\": str}.\n"
+                "• `code` is plain Python using `assert` against the functions/classes defined in the code; "
+                "they are already in scope, do NOT import or redefine them.\n"
+                "• Each test must be fast (well under a second), deterministic, "
+                "and must not read input, files or the network.\n"
+                f"• At most {max_tests} tests, covering normal cases, edge cases and invalid input.\n\n"
+                f"REQUIREMENTS:\n{self.requirements}\n"
+            ),
+            agent=agent,
+            expected_output="A JSON array of test cases with name and code.",
+            context=[code_context],
+            async_execution=False
+        )
+
     # ===========================
     # 4) CODE REFINEMENT
     # ===========================
-    def refine_code_task(self, agent, code_context, review_context):
+    def refine_code_task(self, agent, code_context, review_context, test_report=None):
         return Task(
             description=(
                 "You are the Code Refinement Agent.\n\n"
@@ -90,6 +168,11 @@ class SoftwareTasks:
                 "Output ONLY a single fenced code block containing the FINAL corrected code.\n"
                 "NO explanations.\n"
                 "NO comments.\n"
+                + (
+                    "\nGENERATED TEST RESULTS (make every FAIL/ERROR/TIMEOUT test pass "
+                    f"unless the test itself is wrong):\n{test_report}\n"
+                    if test_report else ""
+                )
             ),
             agent=agent,
             expected_output="Single final corrected code block.",
@@ -97,10 +180,31 @@ class SoftwareTasks:
             async_execution=False
         )
 
+    # ===========================
+    # 4b) EXECUTION FIX (deterministic sandbox failure)
+    # ===========================
+    def fix_execution_error_task(self, agent, code, error):
+        return Task(
+            description=(
+                "You are the Code Refinement Agent.\n"
+                "The CODE below fails deterministically when executed; re-running it unchanged will not help.\n"
+                "Fix the root cause of the EXECUTION ERROR without changing the intended behaviour.\n\n"
+                "STRICT OUTPUT RULE:\n"
+                "Output ONLY a single fenced code block containing the FINAL corrected code.\n"
+                "NO explanations.\n\n"
+                f"REQUIREMENTS:\n{self.requirements}\n\n"
+                f"CODE:\n```python\n{code}\n```\n\n"
+                f"EXECUTION ERROR:\n{error}\n"
+            ),
+            agent=agent,
+            expected_output="Single final corrected code block.",
+            async_execution=False
+        )
+
     # ===========================
     # 5) DOCUMENTATION
     # ===========================
-    def document_code_task(self, agent, code_context, review_context):
+    def document_code_task(self, agent, code_context, review_context, test_report=None):
         return Task(
             description=(
                 "You are the Documentation Agent.\n"
@@ -115,6 +219,11 @@ class SoftwareTasks:
                 "• Known limitations\n"
                 "• Future improvements\n\n"
                 "Output MUST be clean markdown, no code unless needed."
+                + (
+                    "\n\nInclude a short Testing section based on these generated test results "
+                    f"(measured before refinement):\n{test_report}\n"
+                    if test_report else ""
+                )
             ),
             agent=agent,
             expected_output="A polished, professional README.md styled documentation.",
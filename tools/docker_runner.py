@@ -1,33 +1,69 @@
 import subprocess
 import threading
 import queue
+import time
+from tools import tracing
+from tools.execution_policy import policy
+from tools.execution_supervisor import SANDBOX_FAILURES, classify_failure, spawn_failure
 
-def run_code_in_docker(code: str, output_queue: queue.Queue, image="python:3.12-slim", timeout=10):
+def run_code_in_docker(code: str, output_queue: queue.Queue, image="python:3.12-slim", timeout=None,
+                       requirement_class=None):
     """
     Run the provided Python code inside a temporary Docker container.
     Streams stdout/stderr line by line to the queue.
+    Deadline and memory/CPU caps come from the shared execution policy unless `timeout` is given.
+    Returns a dict: {status, returncode, stderr, seconds, limits}
     """
+    limits = policy.limits_for(code, requirement_class, backend="docker")
+    if timeout is not None:
+        limits["timeout"] = timeout
+        limits["source"] = "explicit"
+    with tracing.span("sandbox.execute", backend="docker", image=image, **limits) as s:
+        result = _run_code_in_docker(code, output_queue, image, limits)
+        s.attrs["status"] = result["status"]
+    # Container memory is not observable from here, only the runtime is learned;
+    # sandbox failures (daemon down, spawn errors) are not recorded
+    outcome = classify_failure(result)
+    if outcome not in SANDBOX_FAILURES:
+        result["escalates"] = policy.record(code, result["seconds"], outcome, limits,
+                                            requirement_class=requirement_class, backend="docker")
+    result["limits"] = limits
+    return result
+
+
+def _run_code_in_docker(code, output_queue, image, limits):
     cmd = [
         "docker", "run", "--rm", "--network=none",
+        f"--memory={limits['memory_mb']}m",
+        "--ulimit", f"cpu={limits['cpu_seconds']}:{limits['cpu_seconds'] * 2}",
         "-i", image, "python", "-u", "-"
     ]
 
-    proc = subprocess.Popen(
-        cmd,
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        bufsize=1
-    )
+    start = time.time()
+    try:
+        proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1
+        )
+    except OSError as e:
+        return spawn_failure(e)
+    tracing.event("sandbox.spawn", backend="docker", pid=proc.pid)
 
     # Feed the code
     proc.stdin.write(code)
     proc.stdin.close()
 
-    # Read stdout/stderr in separate threads
+    # Read stdout/stderr in separate threads (stderr is also kept for failure classification)
+    stderr_lines = []
+
     def _reader(stream, is_err=False):
         for line in iter(stream.readline, ""):
+            if is_err:
+                stderr_lines.append(line.rstrip("\n"))
             output_queue.put((line.rstrip("\n"), is_err))
         stream.close()
 
@@ -37,7 +73,12 @@ def run_code_in_docker(code: str, output_queue: queue.Queue, image="python:3.12-
     t_err.start()
 
     try:
-        proc.wait(timeout=timeout)
+        proc.wait(timeout=limits["timeout"])
     except subprocess.TimeoutExpired:
         proc.kill()
         output_queue.put(("[Docker Timeout] Process killed.", True))
+        return {"status": "timeout", "returncode": None, "stderr": "\n".join(stderr_lines),
+                "seconds": time.time() - start}
+    t_err.join(timeout=1.0)
+    return {"status": "finished", "returncode": proc.returncode, "stderr": "\n".join(stderr_lines),
+            "seconds": time.time() - start}
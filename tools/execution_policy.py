@@ -0,0 +1,320 @@
+# tools/execution_policy.py
+"""
+Adaptive deadlines and resource limits for the sandbox backends.
+
+Every run records its wall time, peak memory and outcome under two keys,
+both scoped to the backend that ran it (runtimes are not comparable across
+the executor, a plain subprocess and a Docker container): the code
+fingerprint (exact snippet) and the requirement class (e.g. "web",
+"algorithm"). Limits for the next run are taken from the observed percentile
+plus headroom, clamped to the configured bounds:
+
+  1. same fingerprint seen before  -> its own history (escalated by
+     `escalation_factor` after a timeout / resource-limit kill, so
+     legitimately heavy code gets more room; a timeout is only escalated
+     when the code has completed before or was busy on the CPU when killed,
+     a snippet that hangs keeps the deadline it was killed under)
+  2. enough samples for the class  -> class history
+  3. otherwise                     -> the backend's static defaults
+
+A run killed under class or default limits is re-run once by
+execution_supervisor.supervise, which then gets the escalated fingerprint limits.
+
+executor.execute, run_code_in_subprocess and run_code_in_docker all share the
+process-wide `policy` instance.
+"""
+import contextvars
+import hashlib
+import json
+import math
+import os
+import re
+import sys
+import threading
+from contextlib import contextmanager
+
+# Append-only JSONL journal: every process appends one line per run and replays the
+# file on load, so concurrent runs and separate processes never overwrite each other
+HISTORY_FILE = os.environ.get("CREW_EXEC_HISTORY", ".execution_history.jsonl")
+
+# Static defaults per backend (the values used before limits were adaptive)
+BACKEND_DEFAULTS = {
+    "executor": {"timeout": 4, "cpu_seconds": 2, "memory_mb": 64},
+    "subprocess": {"timeout": 8, "cpu_seconds": 5, "memory_mb": 200},
+    "docker": {"timeout": 10, "cpu_seconds": 10, "memory_mb": 256},
+}
+
+# Coarse requirement classes, first match wins
+REQUIREMENT_CLASSES = [
+    ("web", ("flask", "django", "fastapi", "http", "api", "server", "website", "web")),
+    ("ml", ("train", "neural", "sklearn", "regression", "classifier", "machine learning")),
+    ("data", ("pandas", "csv", "dataframe", "numpy", "matrix", "dataset", "statistics")),
+    ("io", ("file", "directory", "folder", "read", "write", "log")),
+    ("algorithm", ("sort", "search", "fibonacci", "prime", "graph", "tree", "algorithm", "recursion")),
+    ("cli", ("cli", "command line", "argparse", "terminal", "menu")),
+]
+
+_requirement_class = contextvars.ContextVar("crew_requirement_class", default=None)
+
+
+def classify_requirement(text: str) -> str:
+    text = (text or "").lower()
+    for name, keywords in REQUIREMENT_CLASSES:
+        if any(re.search(r"\b" + re.escape(k) + r"\b", text) for k in keywords):
+            return name
+    return "general"
+
+
+@contextmanager
+def requirement_context(requirement_class: str | None):
+    """Set the requirement class used by sandbox runs that do not pass one explicitly."""
+    token = _requirement_class.set(requirement_class)
+    try:
+        yield
+    finally:
+        _requirement_class.reset(token)
+
+
+def current_requirement_class():
+    return _requirement_class.get()
+
+
+def fingerprint(code: str) -> str:
+    """Hash of the code with whitespace-only differences normalized away."""
+    lines = [line.rstrip() for line in (code or "").replace("\r\n", "\n").split("\n")]
+    normalized = "\n".join(line for line in lines if line.strip())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+def max_rss_mb(ru_maxrss) -> float:
+    """Convert getrusage().ru_maxrss to MB (kilobytes on Linux, bytes on macOS)."""
+    if ru_maxrss is None:
+        return None
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return ru_maxrss / divisor
+
+
+def _history_key(backend: str, name: str) -> str:
+    return f"{backend}:{name}"
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return None
+    k = max(0, min(len(values) - 1, math.ceil(pct / 100.0 * len(values)) - 1))
+    return values[k]
+
+
+class ExecutionPolicy:
+    def __init__(self,
+                 path: str | None = HISTORY_FILE,
+                 min_timeout: float = 2,
+                 max_timeout: float = 60,
+                 min_memory_mb: int = 64,
+                 max_memory_mb: int = 1024,
+                 percentile: float = 95,
+                 headroom: float = 1.5,
+                 slack_seconds: float = 1.0,
+                 memory_slack_mb: int = 64,
+                 escalation_factor: float = 4,
+                 busy_fraction: float = 0.5,
+                 min_class_samples: int = 5,
+                 max_samples: int = 50,
+                 max_fingerprints: int = 2000,
+                 compact_after: int = 20000):
+        self.path = path
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_memory_mb = min_memory_mb
+        self.max_memory_mb = max_memory_mb
+        self.percentile = percentile
+        self.headroom = headroom
+        self.slack_seconds = slack_seconds
+        self.memory_slack_mb = memory_slack_mb
+        self.escalation_factor = escalation_factor
+        self.busy_fraction = busy_fraction
+        self.min_class_samples = min_class_samples
+        self.max_samples = max_samples
+        self.max_fingerprints = max_fingerprints
+        self.compact_after = compact_after
+        self._lock = threading.Lock()
+        self._history = {"fingerprints": {}, "classes": {}}
+        self._load()
+
+    # ---------- persistence ----------
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        lines = 0
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except (ValueError, KeyError, TypeError):
+                        # Torn or foreign line: skip it rather than break execution
+                        continue
+                    lines += 1
+        except OSError:
+            return
+        if lines > self.compact_after:
+            self._compact()
+
+    def _apply(self, entry):
+        """Add one journal entry ({"fp"?, "class"?, "sample"}) to the in-memory history."""
+        sample = entry["sample"]
+        if entry.get("fp"):
+            fingerprints = self._history["fingerprints"]
+            # Re-insert so the dict stays ordered from least to most recently run
+            fp_entry = fingerprints.pop(entry["fp"], {"samples": []})
+            fp_entry["samples"] = (fp_entry["samples"] + [sample])[-self.max_samples:]
+            fingerprints[entry["fp"]] = fp_entry
+            while len(fingerprints) > self.max_fingerprints:
+                fingerprints.pop(next(iter(fingerprints)))
+        if entry.get("class"):
+            samples = self._history["classes"].get(entry["class"], [])
+            self._history["classes"][entry["class"]] = (samples + [sample])[-self.max_samples:]
+
+    def _append(self, entry):
+        if not self.path:
+            return
+        data = (json.dumps(entry) + "\n").encode("utf-8")
+        try:
+            # One O_APPEND write per line: lines from concurrent writers do not interleave
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+    def _compact(self):
+        """
+        Rewrite the journal with only the retained samples. Lines another process
+        appends while the file is being replaced are lost; this only runs on load,
+        once the journal has grown past `compact_after` lines.
+        """
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for key, entry in self._history["fingerprints"].items():
+                    for sample in entry["samples"]:
+                        f.write(json.dumps({"fp": key, "sample": sample}) + "\n")
+                for key, samples in self._history["classes"].items():
+                    for sample in samples:
+                        f.write(json.dumps({"class": key, "sample": sample}) + "\n")
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+    # ---------- limits ----------
+    def _clamp(self, limits):
+        timeout = min(self.max_timeout, max(self.min_timeout, limits["timeout"]))
+        memory_mb = int(min(self.max_memory_mb, max(self.min_memory_mb, limits["memory_mb"])))
+        cpu_seconds = int(math.ceil(min(timeout, max(1, limits["cpu_seconds"]))))
+        return {"timeout": round(timeout, 2), "cpu_seconds": cpu_seconds, "memory_mb": memory_mb}
+
+    def _from_samples(self, samples, defaults):
+        ok = [s for s in samples if s["outcome"] == "ok"]
+        seconds = [s["seconds"] for s in ok]
+        memory = [s["memory_mb"] for s in ok if s.get("memory_mb")]
+        limits = dict(defaults)
+        if seconds:
+            p = _percentile(seconds, self.percentile)
+            limits["timeout"] = p * self.headroom + self.slack_seconds
+            limits["cpu_seconds"] = limits["timeout"]
+        if memory:
+            # Peak RSS is measured but RLIMIT_AS caps address space, which is always larger;
+            # memory caps are therefore only ever raised above the backend default, never tightened.
+            limits["memory_mb"] = max(
+                defaults["memory_mb"],
+                _percentile(memory, self.percentile) * self.headroom + self.memory_slack_mb,
+            )
+        return limits
+
+    def limits_for(self, code: str | None = None, requirement_class: str | None = None,
+                   backend: str = "subprocess") -> dict:
+        """
+        Return {"timeout", "cpu_seconds", "memory_mb", "source"} for the next run.
+        """
+        defaults = dict(BACKEND_DEFAULTS[backend])
+        requirement_class = requirement_class or current_requirement_class()
+        factor = self.escalation_factor
+        with self._lock:
+            fp_entry = (self._history["fingerprints"].get(_history_key(backend, fingerprint(code)))
+                        if code else None)
+            class_samples = (self._history["classes"].get(_history_key(backend, requirement_class), [])
+                             if requirement_class else [])
+
+            if fp_entry and fp_entry["samples"]:
+                samples = fp_entry["samples"]
+                limits = self._from_samples(samples, defaults)
+                source = "fingerprint"
+                last = samples[-1]
+                # The same code was killed last time: give it more room (bounded) instead of repeating
+                if last["outcome"] == "timeout":
+                    if self._may_complete(samples):
+                        limits["timeout"] = max(limits["timeout"], last["limits"]["timeout"] * factor)
+                        limits["cpu_seconds"] = limits["timeout"]
+                    else:
+                        # Probably hangs: do not spend more wall time on it than last time
+                        limits = dict(last["limits"])
+                elif last["outcome"] == "resource_limit":
+                    limits["memory_mb"] = max(limits["memory_mb"], last["limits"]["memory_mb"] * factor)
+                    limits["cpu_seconds"] = max(limits["cpu_seconds"], last["limits"]["cpu_seconds"] * factor)
+                    # CPU time is capped at the wall deadline, which has to grow with it
+                    limits["timeout"] = max(limits["timeout"], limits["cpu_seconds"])
+            elif len([s for s in class_samples if s["outcome"] == "ok"]) >= self.min_class_samples:
+                limits = self._from_samples(class_samples, defaults)
+                source = f"class:{requirement_class}"
+            else:
+                limits, source = defaults, "default"
+
+        limits = self._clamp(limits)
+        limits["source"] = source
+        return limits
+
+    def _may_complete(self, samples) -> bool:
+        """
+        Evidence that timed-out code would finish given more time: it completed
+        before, or it was busy on the CPU (not blocked or sleeping) when killed.
+        """
+        if any(s["outcome"] == "ok" for s in samples):
+            return True
+        last = samples[-1]
+        return bool(last.get("cpu_seconds")) and last["cpu_seconds"] >= self.busy_fraction * last["seconds"]
+
+    # ---------- recording ----------
+    def record(self, code: str, seconds: float, outcome: str, limits: dict,
+               memory_mb: float | None = None, requirement_class: str | None = None,
+               backend: str = "subprocess", cpu_seconds: float | None = None) -> bool:
+        """
+        Record one run (outcome as classified by execution_supervisor.classify_failure).
+        Returns True when it was a kill the next run of this code gets escalated limits for.
+        """
+        requirement_class = requirement_class or current_requirement_class()
+        sample = {
+            "seconds": round(seconds, 4),
+            "memory_mb": round(memory_mb, 1) if memory_mb else None,
+            "cpu_seconds": round(cpu_seconds, 3) if cpu_seconds is not None else None,
+            "outcome": outcome,
+            "limits": {k: limits[k] for k in ("timeout", "cpu_seconds", "memory_mb")},
+        }
+        entry = {
+            "fp": _history_key(backend, fingerprint(code)),
+            "class": _history_key(backend, requirement_class) if requirement_class else None,
+            "sample": sample,
+        }
+        with self._lock:
+            self._apply(entry)
+            samples = self._history["fingerprints"][entry["fp"]]["samples"]
+            escalates = outcome == "resource_limit" or (outcome == "timeout" and self._may_complete(samples))
+        # Disk I/O stays outside the lock, concurrent runs only contend on the in-memory update
+        self._append(entry)
+        return escalates
+
+
+# Process-wide policy shared by all sandbox backends
+policy = ExecutionPolicy()
@@ -0,0 +1,158 @@
+# tools/execution_supervisor.py
+import errno
+import re
+import time
+
+from tools import tracing
+
+# Failure classes
+OK = "ok"
+DETERMINISTIC = "deterministic"      # the code itself is wrong: re-running it cannot help
+TIMEOUT = "timeout"                  # hit the wall-clock deadline
+RESOURCE_LIMIT = "resource_limit"    # killed by an rlimit (memory, CPU, file size)
+TRANSIENT = "transient"              # sandbox/OS hiccup: worth retrying as-is
+SANDBOX_ERROR = "sandbox_error"      # sandbox misconfigured (missing interpreter/docker...): retrying cannot help
+
+# Outcomes caused by the sandbox, not the code: they say nothing about its runtime
+SANDBOX_FAILURES = (TRANSIENT, SANDBOX_ERROR)
+
+# Spawn errors caused by momentary resource exhaustion (process/fd tables, memory)
+_TRANSIENT_SPAWN_ERRNOS = {errno.EAGAIN, errno.EMFILE, errno.ENFILE, errno.ENOMEM}
+
+# Negative return codes = killed by signal. SIGKILL(9), SIGSEGV(11), SIGXCPU(24), SIGXFSZ(25);
+# Docker reports the same signals as 128 + signal number (137 = OOM kill)
+_RESOURCE_SIGNALS = {-9, -11, -24, -25, 137, 139, 152, 153}
+
+_TRANSIENT_PATTERNS = re.compile(
+    r"BlockingIOError|Resource temporarily unavailable|Too many open files|"
+    r"BrokenPipeError|ConnectionResetError|Executor internal error|"
+    r"No structured result from wrapper|Cannot connect to the Docker daemon",
+    re.IGNORECASE,
+)
+_RESOURCE_PATTERNS = re.compile(r"MemoryError|Cannot allocate memory")
+_TRACEBACK_EXC = re.compile(r"^(\w+(?:\.\w+)*(?:Error|Exception|Exit|Interrupt))\b", re.MULTILINE)
+
+
+def _error_text(result: dict) -> str:
+    return "\n".join(
+        str(result.get(k) or "") for k in ("stderr", "traceback", "process_stderr")
+    )
+
+
+def classify_failure(result: dict) -> str:
+    """
+    Classify a sandbox result dict (from executor.execute, run_code_in_subprocess
+    or the Docker runner) into one of OK / DETERMINISTIC / TIMEOUT / RESOURCE_LIMIT /
+    TRANSIENT / SANDBOX_ERROR.
+    """
+    status = result.get("status")
+    returncode = result.get("returncode")
+    text = _error_text(result)
+
+    if result.get("sandbox_error"):
+        return SANDBOX_ERROR
+    if status in ("finished", "success") and returncode == 0:
+        return OK
+    if status == "timeout":
+        return TIMEOUT
+    if (returncode in _RESOURCE_SIGNALS) or _RESOURCE_PATTERNS.search(text):
+        return RESOURCE_LIMIT
+    if _TRANSIENT_PATTERNS.search(text):
+        return TRANSIENT
+    if status == "error" and returncode is None:
+        # The sandbox itself failed before running the code
+        return TRANSIENT
+    # A traceback or a plain non-zero exit: the code is at fault
+    return DETERMINISTIC
+
+
+def failure_summary(result: dict, max_chars: int = 2000) -> str:
+    """Short error description for logs and for the refiner prompt (tail of stderr)."""
+    text = _error_text(result).strip()
+    if not text:
+        return f"status={result.get('status')} returncode={result.get('returncode')}"
+    return text[-max_chars:]
+
+
+def last_exception(result: dict):
+    """Name of the last exception in the traceback (e.g. 'ImportError'), if any."""
+    found = _TRACEBACK_EXC.findall(_error_text(result))
+    return found[-1] if found else None
+
+
+def spawn_failure(error: OSError) -> dict:
+    """
+    Result dict for a sandbox process that could not be started. Resource exhaustion
+    (EAGAIN, EMFILE, ENFILE, ENOMEM) is transient; anything else (a missing `docker`
+    binary or interpreter, a permission error...) is a SANDBOX_ERROR.
+    """
+    result = {"status": "error", "returncode": None, "stderr": f"Sandbox spawn failed: {error!r}", "seconds": 0.0}
+    if not (isinstance(error, BlockingIOError) or error.errno in _TRANSIENT_SPAWN_ERRNOS):
+        result["sandbox_error"] = True
+        result["stderr"] = f"Sandbox configuration error: {error!r}"
+    return result
+
+
+def _escalatable(outcome: str, result: dict) -> bool:
+    # Only learned-from-others limits are escalated: fingerprint limits already come from this
+    # code's own history (and are escalated there), explicit limits were chosen by the caller.
+    # result["escalates"] is set by the backend when the policy will actually give the next run
+    # more room (a timeout with no sign the code would ever finish is not worth a re-run).
+    source = (result.get("limits") or {}).get("source") or ""
+    return (outcome in (TIMEOUT, RESOURCE_LIMIT) and bool(result.get("escalates"))
+            and (source == "default" or source.startswith("class:")))
+
+
+def supervise(run, max_attempts: int = 3, backoff: float = 0.5, max_backoff: float = 8.0, report=None,
+              max_escalations: int = 1):
+    """
+    Call `run()` (returning a sandbox result dict) and retry ONLY transient failures,
+    with exponential backoff. Deterministic failures are returned immediately: running
+    identical code again would fail the same way.
+
+    Timeout and resource-limit kills under class or default limits (result["limits"]["source"])
+    are re-run up to `max_escalations` times when the execution policy escalates them
+    (result["escalates"]): the backend re-queries the policy, which raises the limits from
+    the kill it just recorded for this code.
+
+    OSErrors raised by `run()` are classified like spawn_failure(): fork/exec failing
+    with EAGAIN, EMFILE... is transient, other errors are returned as SANDBOX_ERROR. `report(message)` is called for every attempt/outcome if provided.
+    Returns {"outcome", "result", "attempts": [{attempt, status, returncode, failure, seconds}]}.
+    """
+    attempts = []
+    result, outcome = {}, TRANSIENT
+    escalations = 0
+    attempt = 0
+    while True:
+        attempt += 1
+        start = time.time()
+        with tracing.span("sandbox.attempt", attempt=attempt) as s:
+            try:
+                result = run()
+            except OSError as e:
+                result = spawn_failure(e)
+            outcome = classify_failure(result)
+            s.attrs["failure"] = outcome
+        attempts.append({
+            "attempt": attempt,
+            "status": result.get("status"),
+            "returncode": result.get("returncode"),
+            "failure": outcome,
+            "seconds": round(time.time() - start, 3),
+        })
+        if report:
+            exc = last_exception(result)
+            report(f"Attempt {attempt}: {outcome}" + (f" ({exc})" if exc and outcome != OK else ""))
+        if escalations < max_escalations and _escalatable(outcome, result):
+            escalations += 1
+            if report:
+                report(f"Killed under {result['limits']['source']} limits, re-running with escalated limits")
+            continue
+        if outcome != TRANSIENT or attempt >= max_attempts + escalations:
+            break
+        delay = min(max_backoff, backoff * (2 ** (attempt - 1)))
+        if report:
+            report(f"Transient failure, retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+    return {"outcome": outcome, "result": result, "attempts": attempts}
@@ -5,28 +5,54 @@ import json
 import sys
 import os
 import textwrap
+import time
 from crewai.tools import tool
+from tools import tracing
+from tools.execution_policy import policy, max_rss_mb
+from tools.execution_supervisor import SANDBOX_FAILURES, classify_failure
 
 # Whitelist of safe modules (you can extend carefully)
 SAFE_MODULES = ["math", "random", "statistics"]
 
 @tool("Execute Python Code (Sandboxed)")
-def execute(code: str, timeout_seconds: int = 4):
+def execute(code: str, timeout_seconds: int | None = None):
     """
     Execute `code` inside a sandbox subprocess with:
       - builtin overrides to block open/input/os.system/subprocess
       - blocked imports except SAFE_MODULES
-      - timeout (timeout_seconds)
-    Returns a dict: {status, returncode, stdout, stderr, details}
+      - timeout (timeout_seconds, adaptive from execution history if omitted)
+    Returns a dict: {status, returncode, stdout, stderr, details, limits}
     """
+    limits = policy.limits_for(code, backend="executor")
+    if timeout_seconds is not None:
+        limits["timeout"] = timeout_seconds
+        limits["source"] = "explicit"
+    with tracing.span("sandbox.execute", backend="executor", **limits) as s:
+        start = time.time()
+        result = _execute(code, limits)
+        s.attrs["status"] = result.get("status")
+    outcome = classify_failure(result)
+    if outcome not in SANDBOX_FAILURES:
+        result["escalates"] = policy.record(code, time.time() - start, outcome, limits,
+                                            memory_mb=max_rss_mb(result.get("max_rss_kb")), backend="executor")
+    result["limits"] = limits
+    return result
+
+
+def _execute(code: str, limits: dict):
+    timeout_seconds = limits["timeout"]
 
     # 1) Create wrapper script which sets up sandboxing then execs user code
     #    We pass the user's code embedded as a JSON string for safety.
     wrapper = textwrap.dedent(
         r'''
         import json, sys, builtins, io, traceback
+        try:
+            import resource  # imported before the import guard below is installed
+        except ImportError:
+            resource = None
 
-        USER_CODE = json.loads(r''' + json.dumps(json.dumps(code)) + r''')
+        USER_CODE = json.loads(__USER_CODE_JSON__)
 
         # ----------------------------
         # Replace dangerous builtins
@@ -72,11 +98,10 @@ def execute(code: str, timeout_seconds: int = 4):
 
         # Optional: set resource limits if available (unix)
         try:
-            import resource
-            # 64MB address space (soft)
-            resource.setrlimit(resource.RLIMIT_AS, (64 * 1024 * 1024, resource.RLIM_INFINITY))
-            # 2 second cpu time
-            resource.setrlimit(resource.RLIMIT_CPU, (2, 4))
+            # address space (soft), from the execution policy
+            resource.setrlimit(resource.RLIMIT_AS, (%d * 1024 * 1024, resource.RLIM_INFINITY))
+            # cpu time
+            resource.setrlimit(resource.RLIMIT_CPU, (%d, %d))
         except Exception:
             # resource may be unavailable on Windows or restricted envs — continue
             pass
@@ -106,9 +131,13 @@ def execute(code: str, timeout_seconds: int = 4):
             sys.stdout, sys.stderr = real_stdout, real_stderr
             result["stdout"] = out_buf.getvalue()
             result["stderr"] = err_buf.getvalue()
+            if resource is not None:
+                result["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
             print(json.dumps(result, default=str))
-        ''' % (json.dumps(SAFE_MODULES))
+        ''' % (json.dumps(SAFE_MODULES), limits["memory_mb"], limits["cpu_seconds"], limits["cpu_seconds"] * 2)
     )
+    # Substituted after %-formatting so '%' in user code cannot break the template
+    wrapper = wrapper.replace("__USER_CODE_JSON__", repr(json.dumps(code)), 1)
 
     # 2) Write wrapper to temp file and run in subprocess using same Python executable
     with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False, encoding="utf-8") as tf:
@@ -117,12 +146,13 @@ def execute(code: str, timeout_seconds: int = 4):
 
     try:
         # run subprocess
-        proc = subprocess.run(
-            [sys.executable, wrapper_path],
-            capture_output=True,
-            text=True,
-            timeout=timeout_seconds
-        )
+        with tracing.span("sandbox.spawn", backend="executor"):
+            proc = subprocess.run(
+                [sys.executable, wrapper_path],
+                capture_output=True,
+                text=True,
+                timeout=timeout_seconds
+            )
 
         stdout = proc.stdout.strip()
         stderr = proc.stderr.strip()
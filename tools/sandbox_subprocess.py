@@ -6,29 +6,44 @@ import os
 import threading
 import time
 import shutil
+from tools import tracing
+from tools.execution_policy import policy, max_rss_mb
+from tools.execution_supervisor import SANDBOX_FAILURES, classify_failure, spawn_failure
 
-def _set_resource_limits():
+# Runs `python sandbox_boot.py sandbox_exec.py`: guards input(), then runs the user script as __main__
+_BOOTSTRAP = """\
+import builtins, runpy, sys
+builtins.input = lambda *a, **k: (_ for _ in ()).throw(RuntimeError('input() disabled in sandbox'))
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+def _resource_limiter(limits: dict):
     """
-    Called in child process (Unix only) before exec to limit resources.
+    Build the preexec_fn called in the child process (Unix only) before exec to limit resources.
     """
-    try:
-        import resource
-        # Limit address space to 200MB (soft limit)
-        resource.setrlimit(resource.RLIMIT_AS, (200 * 1024 * 1024, resource.RLIM_INFINITY))
-        # Limit CPU time to 5 seconds
-        resource.setrlimit(resource.RLIMIT_CPU, (5, 10))
-        # Limit file size (bytes)
-        resource.setrlimit(resource.RLIMIT_FSIZE, (10 * 1024 * 1024, resource.RLIM_INFINITY))
-    except Exception:
-        # resource may not be available on Windows or some environments
-        pass
+    def _set_resource_limits():
+        try:
+            import resource
+            # Limit address space (soft limit)
+            resource.setrlimit(resource.RLIMIT_AS, (limits["memory_mb"] * 1024 * 1024, resource.RLIM_INFINITY))
+            # Limit CPU time (SIGXCPU at the soft limit, SIGKILL at the hard one)
+            resource.setrlimit(resource.RLIMIT_CPU, (limits["cpu_seconds"], limits["cpu_seconds"] * 2))
+            # Limit file size (bytes)
+            resource.setrlimit(resource.RLIMIT_FSIZE, (10 * 1024 * 1024, resource.RLIM_INFINITY))
+        except Exception:
+            # resource may not be available on Windows or some environments
+            pass
+    return _set_resource_limits
 
 def run_code_in_subprocess(code: str,
-                           timeout: int = 8,
+                           timeout: float | None = None,
                            working_dir: str | None = None,
                            python_executable: str | None = None,
                            env: dict | None = None,
-                           stream_consumer=None):
+                           stream_consumer=None,
+                           requirement_class: str | None = None):
     """
     Execute the provided Python `code` in a temporary file inside a subprocess.
     Streams stdout/stderr line-by-line to `stream_consumer(line, is_stderr:bool)` if provided.
@@ -36,12 +51,51 @@ def run_code_in_subprocess(code: str,
 
     Parameters:
       code: source code string to execute
-      timeout: maximum total seconds to allow subprocess to run
+      timeout: maximum total seconds to allow subprocess to run (default: adaptive, from the execution policy)
       working_dir: directory to set as cwd inside the subprocess (or None)
       python_executable: which python to run (default: sys.executable)
       env: custom environment variables dict (merged with os.environ)
       stream_consumer: optional callable called as stream_consumer(line, is_stderr: bool)
+      requirement_class: class used for the adaptive limits (default: the current requirement context)
+    """
+    limits = policy.limits_for(code, requirement_class, backend="subprocess")
+    if timeout is not None:
+        limits["timeout"] = timeout
+        limits["source"] = "explicit"
+    with tracing.span("sandbox.execute", backend="subprocess", **limits) as s:
+        result = _run_code_in_subprocess(code, limits, working_dir, python_executable, env, stream_consumer)
+        s.attrs["status"] = result.get("status")
+        s.attrs["returncode"] = result.get("returncode")
+    outcome = classify_failure(result)
+    # A sandbox failure says nothing about the code's runtime, keep it out of the history
+    if outcome not in SANDBOX_FAILURES:
+        result["escalates"] = policy.record(
+            code, result["seconds"], outcome, limits, memory_mb=result.get("max_rss_mb"),
+            requirement_class=requirement_class, backend="subprocess", cpu_seconds=result.get("cpu_seconds"))
+    result["limits"] = limits
+    return result
+
+
+def _wait_step(proc):
     """
+    Non-blocking reap of the child. On Unix uses wait4() so the child's resource
+    usage (peak RSS, CPU time) is available; returns (finished, rusage or None).
+    """
+    if hasattr(os, "wait4"):
+        pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+        if pid == 0:
+            return False, None
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        return True, rusage
+    return proc.poll() is not None, None
+
+
+def _cpu_seconds(rusage):
+    return None if rusage is None else rusage.ru_utime + rusage.ru_stime
+
+
+def _run_code_in_subprocess(code, limits, working_dir, python_executable, env, stream_consumer):
+    timeout = limits["timeout"]
 
     python_executable = python_executable or sys.executable
     if working_dir is None:
@@ -50,24 +104,15 @@ def run_code_in_subprocess(code: str,
     # Create temp directory to run in
     tmpdir = tempfile.mkdtemp(prefix="sandbox_")
     script_path = os.path.join(tmpdir, "sandbox_exec.py")
+    bootstrap_path = os.path.join(tmpdir, "sandbox_boot.py")
 
-    # Wrap code to prevent interactive input and to show an explicit banner
-    wrapped_code = (
-        "import sys\n"
-        "import builtins\n"
-        "builtins.input = lambda *a, **k: (_ for _ in ()).throw(RuntimeError('input() disabled in sandbox'))\n"
-        "try:\n"
-        "    # user code begins\n"
-        + code.replace("\r\n", "\n")
-        + "\n    # user code ends\n"
-        "except Exception as __e:\n"
-        "    import traceback\n"
-        "    traceback.print_exc()\n"
-        "    raise\n"
-    )
-
+    # The user code is written unchanged (so `from __future__` imports stay first and
+    # line numbers match); a separate bootstrap disables interactive input and runs it
+    # as __main__. Uncaught exceptions still print a traceback and exit non-zero.
     with open(script_path, "w", encoding="utf-8") as f:
-        f.write(wrapped_code)
+        f.write(code.replace("\r\n", "\n"))
+    with open(bootstrap_path, "w", encoding="utf-8") as f:
+        f.write(_BOOTSTRAP)
 
     # Build the subprocess invocation
     proc_env = os.environ.copy()
@@ -77,19 +122,24 @@ def run_code_in_subprocess(code: str,
     # On Windows, preexec_fn is not supported; on Unix, use to set resource limits
     preexec_fn = None
     if os.name != "nt":
-        preexec_fn = _set_resource_limits
+        preexec_fn = _resource_limiter(limits)
 
     # Start subprocess
-    proc = subprocess.Popen(
-        [python_executable, script_path],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        cwd=working_dir,
-        env=proc_env,
-        text=True,
-        bufsize=1,
-        preexec_fn=preexec_fn,
-    )
+    try:
+        proc = subprocess.Popen(
+            [python_executable, bootstrap_path, script_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=working_dir,
+            env=proc_env,
+            text=True,
+            bufsize=1,
+            preexec_fn=preexec_fn,
+        )
+    except OSError as e:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        return spawn_failure(e)
+    tracing.event("sandbox.spawn", backend="subprocess", pid=proc.pid)
 
     stdout_lines = []
     stderr_lines = []
@@ -118,14 +168,21 @@ def run_code_in_subprocess(code: str,
     t_err.start()
 
     # Wait with timeout
+    rusage = None
     try:
         while True:
-            if proc.poll() is not None:
+            finished, rusage = _wait_step(proc)
+            if finished:
                 break
             if time.time() - start_time > timeout:
-                # timeout -> kill process
+                # timeout -> kill process, reaping it ourselves to learn how much CPU it used
+                seconds = time.time() - start_time
                 try:
                     proc.kill()
+                    deadline = time.time() + 1.0
+                    while not finished and time.time() < deadline:
+                        finished, rusage = _wait_step(proc)
+                        time.sleep(0.01)
                 except Exception:
                     pass
                 return {
@@ -133,8 +190,11 @@ def run_code_in_subprocess(code: str,
                     "returncode": None,
                     "stdout": "\n".join(stdout_lines),
                     "stderr": "\n".join(stderr_lines) + "\n[Process killed due to timeout]",
+                    "seconds": seconds,
+                    "cpu_seconds": _cpu_seconds(rusage),
                 }
             time.sleep(0.05)
+        seconds = time.time() - start_time
 
         # Ensure readers finish
         t_out.join(timeout=1.0)
@@ -145,6 +205,9 @@ def run_code_in_subprocess(code: str,
             "returncode": proc.returncode,
             "stdout": "\n".join(stdout_lines),
             "stderr": "\n".join(stderr_lines),
+            "seconds": seconds,
+            "max_rss_mb": max_rss_mb(rusage.ru_maxrss if rusage else None),
+            "cpu_seconds": _cpu_seconds(rusage),
         }
     finally:
         # Clean up temp dir (best-effort)
@@ -0,0 +1,82 @@
+# tools/startup_profile.py
+"""
+Import-time profile and cold-start measurement.
+
+    python -m tools.startup_profile                 # profile `import main`
+    python -m tools.startup_profile --module app --top 25
+    python -m tools.startup_profile --runs 10       # cold-start timing only
+
+Each measurement runs in a fresh interpreter, so the numbers reflect what a
+CLI invocation or a new worker process pays.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def import_profile(module: str, cwd: str | None = None):
+    """
+    Run `python -X importtime -c "import <module>"` and parse its report.
+    Returns a list of (cumulative_us, self_us, name) sorted by cumulative time.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=cwd,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+        except ValueError:
+            continue
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    rows.sort(reverse=True)
+    return rows
+
+
+def cold_start(command: list, runs: int = 5, cwd: str | None = None):
+    """Wall-clock seconds of `command` in fresh processes: (median, min, max)."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, capture_output=True, cwd=cwd)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), min(timings), max(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time profile and cold-start timing.")
+    parser.add_argument("--module", default="main", help="module to import (default: %(default)s)")
+    parser.add_argument("--top", type=int, default=15, help="rows of the import report to show")
+    parser.add_argument("--runs", type=int, default=5, help="cold-start repetitions")
+    args = parser.parse_args(argv)
+
+    cwd = os.getcwd()
+    rows = import_profile(args.module, cwd=cwd)
+    print(f"Import profile for `import {args.module}` (top {args.top} by cumulative time)")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_us, self_us, name in rows[:args.top]:
+        print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {name}")
+
+    baseline = cold_start([sys.executable, "-c", "pass"], args.runs, cwd)
+    target = cold_start([sys.executable, "-c", f"import {args.module}"], args.runs, cwd)
+    print()
+    print(f"Cold start over {args.runs} runs (median / min / max seconds):")
+    print(f"  bare interpreter   {baseline[0]:.3f} / {baseline[1]:.3f} / {baseline[2]:.3f}")
+    print(f"  import {args.module:<11} {target[0]:.3f} / {target[1]:.3f} / {target[2]:.3f}")
+    if args.module == "main":
+        cli = cold_start([sys.executable, "main.py", "--help"], args.runs, cwd)
+        print(f"  main.py --help     {cli[0]:.3f} / {cli[1]:.3f} / {cli[2]:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# tools/test_sharding.py
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from tools import tracing
+from tools.sandbox_subprocess import run_code_in_subprocess
+from tools.execution_policy import requirement_context
+
+RESULT_MARKER = "__TEST_RESULT__"
+START_MARKER = "__TEST_START__"
+# Wall-clock limit for loading the program and for each test inside a shard
+TEST_TIMEOUT = float(os.environ.get("CREW_TEST_TIMEOUT", "2"))
+# Shard runs are learned as their own requirement class by the execution policy
+SHARD_CLASS = "tests"
+
+# Runs inside each shard process: load the program once (without triggering its
+# `if __name__ == "__main__":` block), then run every test in a copy of its namespace.
+# A real-time interval timer bounds the load and each test, so a slow or looping test
+# is reported as a timeout on its own instead of taking the whole shard down.
+_SHARD_TEMPLATE = r'''
+import json, signal, time, traceback
+
+PROGRAM = json.loads(%(program)s)
+TESTS = json.loads(%(tests)s)
+TEST_TIMEOUT = %(test_timeout)r
+
+
+class TestTimeout(BaseException):
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise TestTimeout("exceeded %%ss test timeout" %% TEST_TIMEOUT)
+
+
+# No interval timers on Windows: tests are then only bounded by the shard deadline
+TIMER = hasattr(signal, "setitimer")
+
+
+def _run(code, name, namespace):
+    if TIMER:
+        signal.setitimer(signal.ITIMER_REAL, TEST_TIMEOUT)
+    try:
+        exec(compile(code, name, "exec"), namespace)
+    finally:
+        if TIMER:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+if TIMER:
+    signal.signal(signal.SIGALRM, _on_alarm)
+namespace = {"__name__": "program_under_test"}
+load_error = None
+try:
+    _run(PROGRAM, "program.py", namespace)
+except BaseException:
+    load_error = traceback.format_exc(limit=3)
+
+for test in TESTS:
+    print(%(start_marker)r + test["name"], flush=True)
+    start = time.time()
+    if load_error:
+        status, detail = "error", "program failed to load: " + load_error
+    else:
+        try:
+            _run(test["code"], test["name"], dict(namespace))
+            status, detail = "pass", ""
+        except TestTimeout as e:
+            status, detail = "timeout", str(e)
+        except AssertionError as e:
+            status, detail = "fail", str(e) or traceback.format_exc(limit=2)
+        except BaseException:
+            status, detail = "error", traceback.format_exc(limit=2)
+    print(%(marker)r + json.dumps({
+        "name": test["name"],
+        "status": status,
+        "seconds": round(time.time() - start, 4),
+        "detail": detail[-500:],
+    }), flush=True)
+'''
+
+
+def parse_test_cases(text: str):
+    """Parse the test writer's JSON array into [{"name", "code"}]; returns [] if unusable."""
+    text = re.sub(r"```[a-zA-Z]*|```", "", text or "")
+    match = re.search(r"\[.*\]", text, re.DOTALL)
+    if not match:
+        return []
+    try:
+        items = json.loads(match.group(0))
+    except ValueError:
+        return []
+    tests, seen = [], set()
+    for i, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get("code"):
+            continue
+        name = str(item.get("name") or f"test_{i + 1}")
+        if name in seen:
+            name = f"{name}_{i + 1}"
+        seen.add(name)
+        tests.append({"name": name, "code": str(item["code"])})
+    return tests
+
+
+def build_shard_script(code: str, tests, test_timeout: float = TEST_TIMEOUT) -> str:
+    return _SHARD_TEMPLATE % {
+        "program": repr(json.dumps(code)),
+        "tests": repr(json.dumps(tests)),
+        "test_timeout": float(test_timeout),
+        "marker": RESULT_MARKER,
+        "start_marker": START_MARKER,
+    }
+
+
+def _run_shard(code: str, shard, timeout, test_timeout):
+    with requirement_context(SHARD_CLASS):
+        res = run_code_in_subprocess(build_shard_script(code, shard, test_timeout), timeout=timeout)
+    results, running = {}, None
+    for line in res.get("stdout", "").splitlines():
+        if line.startswith(START_MARKER):
+            running = line[len(START_MARKER):]
+        elif line.startswith(RESULT_MARKER):
+            row = json.loads(line[len(RESULT_MARKER):])
+            results[row["name"]] = row
+            running = None
+    # The shard process died anyway (rlimit, native code ignoring the timer...): blame the
+    # test that was running, the ones after it never ran
+    killed = "timeout" if res.get("status") == "timeout" else "crashed"
+    stderr = (res.get("stderr") or "").strip()
+    for test in shard:
+        if test["name"] in results:
+            continue
+        if test["name"] == running:
+            status = killed
+            detail = stderr[-500:] or f"shard process killed (status={res.get('status')}, returncode={res.get('returncode')})"
+        else:
+            status = "not_run"
+            detail = f"shard process was killed while running {running}" if running else stderr[-500:]
+        results[test["name"]] = {"name": test["name"], "status": status, "seconds": None, "detail": detail}
+    return [results[t["name"]] for t in shard]
+
+
+def run_tests_sharded(code: str, tests, workers: int | None = None, timeout: float | None = None,
+                      test_timeout: float = TEST_TIMEOUT):
+    """
+    Split `tests` round-robin into at most `workers` shards (default: CPU count) and
+    run each shard in its own sandbox subprocess, concurrently. Each shard loads the
+    program once and has its own rlimits; inside a shard the load and each test are limited
+    to `test_timeout` seconds, so a slow test is reported as a timeout on its own.
+    `timeout` overrides the per-shard deadline chosen by the execution policy.
+    Returns one result row per test, in the original order.
+    """
+    if not tests:
+        return []
+    workers = max(1, min(workers or os.cpu_count() or 1, len(tests)))
+    shards = [tests[i::workers] for i in range(workers)]
+
+    with tracing.span("tests.sharded", tests=len(tests), shards=workers):
+        run_shard = tracing.propagate(_run_shard)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="test-shard") as pool:
+            shard_results = list(pool.map(lambda shard: run_shard(code, shard, timeout, test_timeout), shards))
+
+    by_name = {row["name"]: row for rows in shard_results for row in rows}
+    return [by_name[t["name"]] for t in tests]
+
+
+def format_matrix(results) -> str:
+    """Markdown pass/fail matrix for the refiner and the documentation writer."""
+    if not results:
+        return "No generated tests were run."
+    counts = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    lines = [
+        "| Test | Status | Seconds | Detail |",
+        "|------|--------|---------|--------|",
+    ]
+    for r in results:
+        detail = (r.get("detail") or "").strip().splitlines()
+        detail = detail[-1] if detail else ""
+        seconds = "-" if r.get("seconds") is None else f"{r['seconds']:.3f}"
+        lines.append(f"| {r['name']} | {r['status'].upper()} | {seconds} | {detail.replace('|', '/')[:120]} |")
+    summary = ", ".join(f"{n} {status}" for status, n in sorted(counts.items()))
+    return f"Generated tests: {len(results)} ({summary})\n\n" + "\n".join(lines)
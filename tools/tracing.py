@@ -0,0 +1,202 @@
+# tools/tracing.py
+"""
+Lightweight nested span tracing for a single crew run.
+
+Spans are appended as JSON lines to TRACE_FILE and can be converted to the
+Chrome trace-event format (chrome://tracing, Perfetto, speedscope):
+
+    python -m tools.tracing crew_trace.jsonl crew_trace.json
+
+Sampling is decided once per root span (i.e. per run) and inherited by all
+child spans, so an unsampled run costs one random() call and a few no-op
+context switches. Set CREW_TRACE_SAMPLE_RATE=1 to trace every run.
+"""
+import contextvars
+import functools
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+TRACE_FILE = os.environ.get("CREW_TRACE_FILE", "crew_trace.jsonl")
+TRACE_SAMPLE_RATE = float(os.environ.get("CREW_TRACE_SAMPLE_RATE", "0"))
+
+_settings = {"path": TRACE_FILE, "sample_rate": TRACE_SAMPLE_RATE}
+_current = contextvars.ContextVar("crew_trace_span", default=None)
+_write_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "sampled", "attrs")
+
+    def __init__(self, trace_id, span_id, parent_id, name, sampled, attrs):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.sampled = sampled
+        self.attrs = attrs
+
+
+def configure(path: str | None = None, sample_rate: float | None = None):
+    """Override the trace file and/or sample rate at runtime."""
+    if path is not None:
+        _settings["path"] = path
+    if sample_rate is not None:
+        _settings["sample_rate"] = sample_rate
+
+
+def current():
+    """The active span in this context (or None)."""
+    return _current.get()
+
+
+def _write(record: dict):
+    line = json.dumps(record, default=str)
+    with _write_lock:
+        with open(_settings["path"], "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def _thread_info():
+    t = threading.current_thread()
+    return {"pid": os.getpid(), "tid": threading.get_ident(), "thread": t.name}
+
+
+def _new_span(name, attrs, parent=None):
+    parent = parent if parent is not None else _current.get()
+    if parent is None:
+        sampled = random.random() < _settings["sample_rate"]
+        return Span(uuid.uuid4().hex, uuid.uuid4().hex[:16], None, name, sampled, attrs)
+    return Span(parent.trace_id, uuid.uuid4().hex[:16], parent.span_id, name, parent.sampled, attrs)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Trace the enclosed block as a span nested under the current one.
+    Yields the Span so callers can add attributes (`s.attrs["key"] = value`).
+    """
+    s = _new_span(name, attrs)
+    token = _current.set(s)
+    start = time.time()
+    try:
+        yield s
+    except BaseException as e:
+        s.attrs["error"] = repr(e)
+        raise
+    finally:
+        _current.reset(token)
+        if s.sampled:
+            _write({
+                "type": "span",
+                "trace_id": s.trace_id,
+                "span_id": s.span_id,
+                "parent_id": s.parent_id,
+                "name": name,
+                "start": start,
+                "end": time.time(),
+                "attrs": s.attrs,
+                **_thread_info(),
+            })
+
+
+def record_span(name: str, start: float, end: float, parent=None, **attrs):
+    """Record an already-measured interval (e.g. a queue wait) under `parent`."""
+    s = _new_span(name, attrs, parent=parent)
+    if s.sampled:
+        _write({
+            "type": "span",
+            "trace_id": s.trace_id,
+            "span_id": s.span_id,
+            "parent_id": s.parent_id,
+            "name": name,
+            "start": start,
+            "end": end,
+            "attrs": attrs,
+            **_thread_info(),
+        })
+
+
+def event(name: str, **attrs):
+    """Record an instant event in the current span, if it is sampled."""
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        return
+    _write({
+        "type": "event",
+        "trace_id": parent.trace_id,
+        "parent_id": parent.span_id,
+        "name": name,
+        "ts": time.time(),
+        "attrs": attrs,
+        **_thread_info(),
+    })
+
+
+def propagate(fn, context: contextvars.Context | None = None):
+    """
+    Wrap `fn` so it runs with the caller's trace context (or a `context` saved
+    earlier with contextvars.copy_context()) when submitted to another thread
+    (ThreadPoolExecutor workers do not inherit contextvars).
+    """
+    ctx = context if context is not None else contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return ctx.copy().run(fn, *args, **kwargs)
+
+    return wrapper
+
+
+def to_chrome_trace(jsonl_path: str, out_path: str, trace_id: str | None = None):
+    """
+    Convert a JSONL trace file to Chrome trace-event JSON.
+    If `trace_id` is given only that run is exported. Returns the event count.
+    """
+    events = []
+    with open(jsonl_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            rec = json.loads(line)
+            if trace_id and rec.get("trace_id") != trace_id:
+                continue
+            args = dict(rec.get("attrs") or {}, trace_id=rec["trace_id"], thread=rec.get("thread"))
+            if rec["type"] == "span":
+                events.append({
+                    "name": rec["name"],
+                    "ph": "X",
+                    "ts": rec["start"] * 1e6,
+                    "dur": max(0.0, rec["end"] - rec["start"]) * 1e6,
+                    "pid": rec["pid"],
+                    "tid": rec["tid"],
+                    "args": args,
+                })
+            else:
+                events.append({
+                    "name": rec["name"],
+                    "ph": "i",
+                    "s": "t",
+                    "ts": rec["ts"] * 1e6,
+                    "pid": rec["pid"],
+                    "tid": rec["tid"],
+                    "args": args,
+                })
+    events.sort(key=lambda e: e["ts"])
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return len(events)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("usage: python -m tools.tracing TRACE.jsonl OUT.json [TRACE_ID]")
+        sys.exit(2)
+    n = to_chrome_trace(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    print(f"Wrote {n} trace events to {sys.argv[2]}")